@@ -5,7 +5,7 @@ setup(
     name='svzerodtrees',
     packages=find_packages(),
     install_requires = [
-        'scipy >= 1.9.1',
+        'scipy >= 1.11',
         'numpy >= 1.22.3',
         'vtk >= 9.1.0',
         'pandas >= 1.4.3',
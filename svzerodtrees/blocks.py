@@ -1,8 +1,44 @@
 from svzerodtrees.utils import *
+import itertools
 import numpy as np
 
 
 
+# source of the unique block tokens, which unlike id() are never reused once a block is garbage collected
+_block_tokens = itertools.count()
+
+
+class VersionedBlock():
+    '''
+    mixin for LPN blocks which counts changes to their attributes and gives each block a unique token, so that a
+    config assembled from the blocks can tell whether it is out of date. attributes which only cache values derived
+    from other attributes are listed in _derived_attrs and are not counted as changes
+    '''
+
+    _derived_attrs = ()
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name not in self._derived_attrs:
+            object.__setattr__(self, '_version', getattr(self, '_version', 0) + 1)
+
+    def __setstate__(self, state):
+        # a copy or unpickled block is a different block, so it gets its own token
+        state = dict(state)
+        state.pop('_token', None)
+        self.__dict__.update(state)
+
+    @property
+    def version(self):
+        return getattr(self, '_version', 0)
+
+    @property
+    def token(self):
+        if '_token' not in self.__dict__:
+            object.__setattr__(self, '_token', next(_block_tokens))
+        return self._token
+
+
 class Vessel():
     '''
     class to handle BloodVessel LPN tree structure creation and dfs on the tree
@@ -54,6 +90,41 @@ class Vessel():
 
         return cls(config)
     
+    def shallow_clone(self, id=None, name=None):
+        '''
+        create a copy of the vessel without its children or parent, which is much cheaper than a deepcopy of the
+        vessel and the tree below it
+
+        :param id: vessel id of the clone. default is the id of this vessel
+        :param name: vessel name of the clone. default is the name of this vessel
+
+        :return: new Vessel instance
+        '''
+
+        clone = Vessel.__new__(Vessel)
+        clone.label = self.label
+        clone.name = self.name if name is None else name
+        clone._children = []
+        clone.parent = None
+        clone.path = list(self.path)
+        clone.gen = self.gen
+        clone.segs = list(self.segs)
+        clone.bc = None if self.bc is None else dict(self.bc)
+        clone.length = self.length
+        clone.id = self.id if id is None else id
+        clone.ids = list(self.ids)
+        clone.branch = self.branch
+        clone._stenosis_coefficient = self._stenosis_coefficient
+        clone._R = self._R
+        clone._C = self._C
+        clone._L = self._L
+        clone._R_eq = self._R_eq
+        clone._C_eq = self._C_eq
+        clone._L_eq = self._L_eq
+        clone._diameter = self._diameter
+
+        return clone
+    
     def to_dict(self):
         '''
         convert the vessel to a dict for zerod solver use
@@ -447,6 +518,46 @@ class BoundaryCondition():
         self.values['Z'] = new_Z
    
 
+class VersionedVessel(VersionedBlock, Vessel):
+    '''
+    vessel which tracks changes to its parameters. reading the equivalent values only updates their caches
+    '''
+
+    _derived_attrs = ('_R_eq', '_C_eq', '_L_eq')
+
+
+class VersionedJunction(VersionedBlock, Junction):
+    '''
+    junction which tracks changes to its parameters
+    '''
+
+
+class VersionedBoundaryCondition(VersionedBlock, BoundaryCondition):
+    '''
+    boundary condition which tracks changes to its parameters
+    '''
+
+
+_VERSIONED_CLASSES = {Vessel: VersionedVessel,
+                      Junction: VersionedJunction,
+                      BoundaryCondition: VersionedBoundaryCondition}
+
+
+def versioned(block):
+    '''
+    switch a vessel, junction or boundary condition to its versioned class in place, so that changes to it are
+    counted from now on. only configs which cache on block versions need this, other blocks are left as they are
+
+    :param block: Vessel, Junction or BoundaryCondition instance
+
+    :return: the same block
+    '''
+    if not isinstance(block, VersionedBlock):
+        block.__class__ = _VERSIONED_CLASSES[type(block)]
+
+    return block
+
+
 class SimParams():
     '''class to handle simulation parameters'''
 
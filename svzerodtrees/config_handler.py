@@ -9,6 +9,43 @@ import pysvzerod
 
 
 
+class BlockMap(dict):
+    '''
+    dict of blocks which counts insertions and deletions, so that views filtered from it can be cached
+    '''
+
+    # class level default so that the count also exists while a pickled map is being rebuilt
+    version = 0
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.version += 1
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.version += 1
+
+    def pop(self, *args):
+        self.version += 1
+        return super().pop(*args)
+
+    def popitem(self):
+        self.version += 1
+        return super().popitem()
+
+    def setdefault(self, key, default=None):
+        self.version += 1
+        return super().setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.version += 1
+
+    def clear(self):
+        super().clear()
+        self.version += 1
+
+
 class ConfigHandler():
     '''
     class to handle configs with and without trees
@@ -18,12 +55,13 @@ class ConfigHandler():
         self._config = config
 
         self.tree_params = {} # list of StructuredTree params
+        self.trees = [] # list of StructuredTree instances, ordered by outlet
 
         # initialize config maps
         self.branch_map = {} # {branch id: Vessel instance}
         self.vessel_map = {} # {vessel id: Vessel instance}
         self.junctions = {} # {junction name: Junction instance}
-        self.bcs = {} # {bc name: BoundaryCondition instance}
+        self.bcs = BlockMap() # {bc name: BoundaryCondition instance}
         self.inflows = {} # (inflow name: Inflow)
 
         self.simparams = None
@@ -52,8 +90,7 @@ class ConfigHandler():
         :param file_name: name of the file to load from
         '''
 
-        with open(file_name) as ff:
-            config = json.load(ff)
+        config = read_json(file_name)
         if "external_solver_coupling_blocks" in config:
             is_threed_interface = True
 
@@ -105,8 +142,7 @@ class ConfigHandler():
         :param file_name: name of the file to write to
         '''
 
-        with open(file_name, 'w') as ff:
-            json.dump(self.config, ff, indent=4)
+        write_json(self.config, file_name)
 
 
     def to_json_w_trees(self, file_name: str):
@@ -116,19 +152,13 @@ class ConfigHandler():
         :param file_name: name of the file to write to
         '''
 
-        outlet_idx = 0
-        for vessel_config in self.config["vessels"]:
-            if "boundary_conditions" in vessel_config:
-                if "outlet" in vessel_config["boundary_conditions"]:
-                    for bc_config in self.config["boundary_conditions"]:
-                        if vessel_config["boundary_conditions"]["outlet"] in bc_config["bc_name"]:
-                            vessel_config["tree"] = list(self.trees.values())[outlet_idx].block_dict
-
-                    outlet_idx += 1
+        # assemble the config once so the trees are written to the same dict that is dumped
+        config = self.config
+        for outlet_idx, vessel_config in enumerate(_outlet_vessel_configs(config)):
+            vessel_config["tree"] = self.trees[outlet_idx].block_dict
 
 
-        with open(file_name, 'w') as ff:
-            json.dump(self.config, ff, indent=4)
+        write_json(config, file_name)
         
         self.clear_config_trees()
 
@@ -293,12 +323,8 @@ class ConfigHandler():
         clear the trees from the config dict
         '''
 
-        for vessel_config in self.config["vessels"]:
-            if "boundary_conditions" in vessel_config:
-                if "outlet" in vessel_config["boundary_conditions"]:
-                    for bc_config in self.config["boundary_conditions"]:
-                        if vessel_config["boundary_conditions"]["outlet"] == bc_config["bc_name"]:
-                            vessel_config["tree"] = {}
+        for vessel_config in _outlet_vessel_configs(self.config):
+            vessel_config["tree"] = {}
     
 
     def update_stree_hemodynamics(self, current_result):
@@ -306,26 +332,20 @@ class ConfigHandler():
         update the hemodynamics of the StructuredTree instances
         '''
 
+        config = self.config
+
         # get the outlet flowrate
-        q_outs = get_outlet_data(self.config, current_result, "flow_out", steady=True)
-        p_outs = get_outlet_data(self.config, current_result, "pressure_out", steady=True)
-        outlet_idx = 0 # need this when iterating through outlets 
+        q_outs = get_outlet_data(config, current_result, "flow_out", steady=True)
+        p_outs = get_outlet_data(config, current_result, "pressure_out", steady=True)
         # get the outlet vessel
-        for vessel_config in self.config["vessels"]:
-            if "boundary_conditions" in vessel_config:
-                if "outlet" in vessel_config["boundary_conditions"]:
-                    for bc_config in self.config["boundary_conditions"]:
-                        if vessel_config["boundary_conditions"]["outlet"] == bc_config["bc_name"]:
-                            # update the outlet flowrate and pressure for the tree at that outlet
-                            list(self.trees.values())[outlet_idx].add_hemodynamics_from_outlet([q_outs[outlet_idx]], [p_outs[outlet_idx]])
+        for outlet_idx, vessel_config in enumerate(_outlet_vessel_configs(config)):
+            # update the outlet flowrate and pressure for the tree at that outlet
+            self.trees[outlet_idx].add_hemodynamics_from_outlet([q_outs[outlet_idx]], [p_outs[outlet_idx]])
 
-                            # re-integrate pries and secomb --- this is not necesary at the moment because I think it will send us into an
-                            # endless loop of re-integration
+            # re-integrate pries and secomb --- this is not necesary at the moment because I think it will send us into an
+            # endless loop of re-integration
 
-                            # self.trees[outlet_idx].integrate_pries_secomb()
-
-                            # count up
-                            outlet_idx += 1
+            # self.trees[outlet_idx].integrate_pries_secomb()
 
 
     def get_time_series(self):
@@ -747,9 +767,42 @@ class ConfigHandler():
         return max(self.bcs["INFLOW"].values['t'])
 
 
+    @property
+    def resistance_bcs(self):
+        '''
+        tuple of (name, BoundaryCondition) for the resistance and RCR boundary conditions, in config order.
+        the tuple is cached until a boundary condition is added to or removed from self.bcs. changing the type
+        of a boundary condition in place does not invalidate the cache.
+        '''
+
+        version = getattr(self.bcs, 'version', None)
+        cache = getattr(self, '_resistance_bcs_cache', None)
+        if version is None or cache is None or cache[0] is not self.bcs or cache[1] != version:
+            resistance_bcs = tuple((name, bc) for name, bc in self.bcs.items() if bc.type in ('RESISTANCE', 'RCR'))
+            if version is None:
+                # plain dict, we can't tell when it changes
+                return resistance_bcs
+            self._resistance_bcs_cache = (self.bcs, version, resistance_bcs)
+
+        return self._resistance_bcs_cache[2]
+
+
     @property
     def config(self):
         self.assemble_config()
         return self._config
 
 
+def _outlet_vessel_configs(config: dict):
+    '''
+    get the configs of the outlet vessels which have a boundary condition in the config, in vessel order
+
+    :param config: svzerodplus config dict
+
+    :return: list of outlet vessel config dicts
+    '''
+
+    bc_names = {bc_config["bc_name"] for bc_config in config["boundary_conditions"]}
+
+    return [vessel_config for vessel_config in config["vessels"]
+            if vessel_config.get("boundary_conditions", {}).get("outlet") in bc_names]
@@ -1,23 +1,50 @@
 import copy
 import csv
 from pathlib import Path
+from functools import partial, lru_cache
 import numpy as np
 import json
 import math
 import matplotlib.pyplot as plt
 from scipy.integrate import trapz
+from numba import njit
 from multiprocess import Pool
 from svzerodtrees.utils import *
 from svzerodtrees.threedutils import *
 from svzerodtrees.post_processing.plotting import *
 from svzerodtrees.post_processing.stree_visualization import *
-from scipy.optimize import minimize, Bounds
+from scipy.optimize import minimize, least_squares, Bounds
 from svzerodtrees.structuredtree import StructuredTree
 from svzerodtrees.adaptation import *
 from svzerodtrees.result_handler import ResultHandler
 from svzerodtrees.config_handler import ConfigHandler
 from svzerodtrees.blocks import *
 from svzerodtrees.inflow import Inflow
+from svzerodtrees.solvers import cg_njit, bobyqa, nlopt_sbplx
+
+
+# scipy.optimize.minimize methods that use the gradient
+_GRADIENT_METHODS = ('CG', 'BFGS', 'L-BFGS-B', 'TNC', 'SLSQP')
+
+# number of objective evaluations between updates of the optimization progress plot
+_PLOT_EVERY = 25
+
+# number of most recent objective function values kept for the optimization progress plot
+_OBJ_FUN_BUFFER_SIZE = 10000
+
+# physical bounds on the optimized outlet bc values, dyn*s/cm^5 for resistances. the lower bound is positive since
+# the unsteady objective penalizes the reciprocal resistances
+_BC_LOWER_BOUND = 1e-6
+_BC_UPPER_BOUND = 1e7
+
+# conversion factor from dyn/cm2 to mmHg used by the pa config
+_INV_MMHG = 1.0 / 1333.2
+
+# number of loss evaluations between progress prints in a verbose pa config optimization
+_PRINT_EVERY = 50
+
+# maximum number of memoized steady pa config simulations per config
+_STEADY_MEMO_SIZE = 512
 
 
 def optimize_outlet_bcs(input_file,
@@ -26,9 +53,12 @@ def optimize_outlet_bcs(input_file,
                         make_steady=False,
                         steady=True,
                         change_to_R=False,
-                        show_optimization=False):
+                        show_optimization=False,
+                        n_procs=4,
+                        use_numba_cg=False,
+                        method='L-BFGS-B'):
     '''
-    optimize the outlet boundary conditions of a 0D model by conjugate gradient method
+    optimize the outlet boundary conditions of a 0D model, by default with the bounded L-BFGS-B method
 
     :param input_file: 0d solver json input file name string
     :param clinical_targets: clinical targets input csv
@@ -37,11 +67,17 @@ def optimize_outlet_bcs(input_file,
     :param steady: False if the input file has unsteady inflow
     :param change_to_R: True if you want to change the input config from RCR to R boundary conditions
     :param show_optimization: True if you want to display a track of the optimization results
+    :param n_procs: number of processes used to evaluate the finite difference gradient. None to run serially
+    :param use_numba_cg: True to use the numba compiled conjugate gradient optimizer instead of scipy's. requires method='CG'
+    :param method: optimization method. 'BOBYQA' to use Py-BOBYQA, otherwise any scipy.optimize.minimize method
 
     :return preop_config: 0D config with optimized BCs
     :return preop_flow: flow result with optimized preop BCs
     '''
 
+    if use_numba_cg and method != 'CG':
+        raise ValueError("use_numba_cg requires method='CG', got method='" + str(method) + "'")
+
     # get the clinical target values, pressures in mmHg
     # get the clinical target values
     clinical_targets = ClinicalTargets.from_csv(clinical_targets, steady=steady)
@@ -63,82 +99,60 @@ def optimize_outlet_bcs(input_file,
     result_handler = ResultHandler.from_config_handler(config_handler)
 
     # scale the inflow
-    # objective function value as global variable
-    global obj_fun
-    obj_fun = [] # for plotting the objective function, maybe there is a better way to do this
+    # objective function values for plotting, kept in a fixed size ring buffer so long runs don't grow memory
+    obj_fun = np.empty(_OBJ_FUN_BUFFER_SIZE)
+    n_obj_fun = 0
+
+    def obj_fun_history():
+        '''
+        get the buffered objective function values in the order they were computed
+        '''
+        if n_obj_fun <= obj_fun.size:
+            return obj_fun[:n_obj_fun]
+        else:
+            return np.roll(obj_fun, -(n_obj_fun % obj_fun.size))
+
     # run zerod simulation to reach clinical targets
-    def zerod_optimization_objective(resistances,
-                                     input_config=config_handler.config,
-                                     target_ps=None,
-                                     steady=steady,
-                                     lpa_branch= result_handler.lpa_branch, # in general, this should be [1, 2]
-                                     rpa_branch = result_handler.rpa_branch,
-                                     rpa_split=clinical_targets.rpa_split
-                                     ):
+    @lru_cache(maxsize=64)
+    def cached_objective(resistances):
         '''
-        objective function for 0D boundary condition optimization
+        objective function memoized on the exact resistance values, so points the optimizer revisits (the base point
+        of each gradient, repeated line search evaluations) are not solved again
 
-        :param resistances: list of resistances or RCR values, given by the optimizer
-        :param input_config: config of the simulation to be optimized
-        :param target_ps: target pressures to optimize against
-        :param unsteady: True if the model to be optimized has an unsteady inflow condition
-        :param lpa_rpa_branch: lpa and rpa branch ids (should always be [1, 2]) 
+        :param resistances: tuple of resistances or RCR values
 
         :return: sum of SSE of pressure targets and flow split targets
         '''
-        print("resistances: ", resistances)
-        # write the optimization iteration resistances to the config
-        config_handler.update_bcs(resistances, rcr=not steady)
-            
-        zerod_result = run_svzerodplus(config_handler.config)
-
-        # get mean, systolic and diastolic pressures
-        mpa_pressures, mpa_sys_p, mpa_dia_p, mpa_mean_p  = get_pressure(zerod_result, branch=0, convert_to_mmHg=True)
+        nonlocal n_obj_fun
 
-        # get the MPA, RPA, LPA flow rates
-        q_MPA = get_branch_result(zerod_result, branch=0, data_name='flow_in', steady=steady)
-        q_RPA = get_branch_result(zerod_result, branch=rpa_branch, data_name='flow_in', steady=steady)
-        q_LPA = get_branch_result(zerod_result, branch=lpa_branch, data_name='flow_in', steady=steady)
+        min_obj = _outlet_bc_objective(np.array(resistances), *objective_args)
 
-        if steady: # take the mean pressure only
-            if type(target_ps) == int:
-                p_diff = abs(target_ps - mpa_mean_p) ** 2
-            else:
-                p_diff = abs(target_ps[2] - mpa_mean_p) ** 2
-        else: # if unsteady, take sum of squares of mean, sys, dia pressure
-            pred_p = np.array([
-                -mpa_sys_p,
-                -mpa_dia_p
-                # -mpa_mean_p
-            ])
-            print("pred_p: ", pred_p)
-            p_diff = np.sum(np.square(np.subtract(pred_p, target_ps[:1]))) + \
-            np.sum(np.array([1 / bc.Rp for bc in list(config_handler.bcs.values())[1:]]) ** 2) + \
-            np.sum(np.array([1 / bc.Rd for bc in list(config_handler.bcs.values())[1:]]) ** 2)
-            # p_diff = (pred_p[0] - target_ps[0]) ** 2
-
-        # penalty = 0
-        # for i, p in enumerate(pred_p):
-        #     penalty += loss_function_bound_penalty(p, target_ps[i])
-            
-
-        # add flow split to optimization by checking RPA flow against flow split
-        RPA_diff = abs((np.mean(q_RPA) - (rpa_split * np.mean(q_MPA)))) ** 2
-        
-        # minimize sum of pressure SSE and flow split SSE
-        min_obj = p_diff + RPA_diff # + penalty
+        # track the progress here rather than on every call, so revisited points are not recorded twice
         if show_optimization:
-            obj_fun.append(min_obj)
-            plot_optimization_progress(obj_fun)
+            obj_fun[n_obj_fun % obj_fun.size] = min_obj
+            n_obj_fun += 1
+            if n_obj_fun % _PLOT_EVERY == 0:
+                plot_optimization_progress(obj_fun_history())
 
         return min_obj
 
+    def zerod_optimization_objective(resistances):
+        '''
+        objective function for 0D boundary condition optimization
+
+        :param resistances: list of resistances or RCR values, given by the optimizer
+
+        :return: sum of SSE of pressure targets and flow split targets
+        '''
+
+        return cached_objective(tuple(np.asarray(resistances, dtype=float).tolist()))
+
     # write to log file for debugging
     write_to_log(log_file, "Optimizing preop outlet resistance...")
 
     # get the initial resistance values
     initial_r = []
-    for bc in config_handler.bcs.values():
+    for name, bc in config_handler.resistance_bcs:
         if bc.type == 'RESISTANCE':
             initial_r.append(bc.R)
         if bc.type == 'RCR':
@@ -146,45 +160,278 @@ def optimize_outlet_bcs(input_file,
             initial_r.append(bc.C)
             initial_r.append(bc.Rd)
 
+    # cache references to the outlet bcs so each objective call writes straight into them
+    outlet_bcs = [bc for name, bc in config_handler.resistance_bcs]
+
+    objective_args = (config_handler,
+                      outlet_bcs,
+                      clinical_targets.mpa_p,
+                      steady,
+                      result_handler.rpa_branch,
+                      # the mpa flow is the prescribed inflow, so the rpa flow target is known up front
+                      clinical_targets.rpa_split * _time_average(config_handler.bcs['INFLOW'].Q, 
+                                                                 config_handler.bcs['INFLOW'].t))
+
+    # resistances and capacitances are positive and physically bounded
+    bounds = [(_BC_LOWER_BOUND, _BC_UPPER_BOUND)] * len(initial_r)
+
+    def run_optimizer(jac=None):
+        '''
+        run the optimization with the chosen method and an optional gradient function
+        '''
+        if method == 'BOBYQA':
+            return bobyqa(zerod_optimization_objective,
+                          initial_r,
+                          bounds=bounds)
+        elif method == 'CG' and use_numba_cg:
+            return cg_njit(zerod_optimization_objective,
+                           initial_r,
+                           jac=jac)
+        else:
+            return minimize(zerod_optimization_objective,
+                            initial_r,
+                            method=method,
+                            jac=jac if method in _GRADIENT_METHODS else None,
+                            options={"disp": False},
+                            bounds=None if method == 'CG' else bounds
+                            )
+
+    def batch_grad(resistances):
+        '''
+        forward difference gradient of the objective function, with the perturbed simulations run as a
+        batch on a single compiled model
+        '''
+        x = np.asarray(resistances, dtype=float)
+        # the base point has almost always just been evaluated by the optimizer
+        f0 = zerod_optimization_objective(x)
+        # same relative step size as the scipy default for finite difference gradients
+        h = np.sqrt(np.finfo(float).eps) * np.maximum(1.0, np.abs(x))
+        perturbed = [x + h[i] * np.eye(len(x))[i] for i in range(len(x))]
+
+        # snapshot the bc values of each perturbed point
+        bc_values = []
+        for x_i in perturbed:
+            _write_outlet_bc_values(outlet_bcs, x_i, rcr=False)
+            bc_values.append({bc.name: dict(bc.values) for bc in outlet_bcs})
+        _write_outlet_bc_values(outlet_bcs, x, rcr=False)
+
+        zerod_results = run_svzerodplus_batch(config_handler.config, bc_values)
+        f = [_outlet_bc_loss(zerod_result, *objective_args[1:]) for zerod_result in zerod_results]
+
+        return (np.array(f) - f0) / h
+
     # run the optimization algorithm
-    if steady:
-        result = minimize(zerod_optimization_objective,
-                        initial_r,
-                        args=(config_handler.config, 
-                              clinical_targets.mpa_p, 
-                              steady, 
-                              result_handler.lpa_branch, 
-                              result_handler.rpa_branch, 
-                              clinical_targets.rpa_split),
-                        method="CG",
-                        options={"disp": False},
-                        )
+    if steady and method in _GRADIENT_METHODS:
+        if n_procs is None:
+            result = run_optimizer(jac=batch_grad)
+        else:
+            # the config handler and the other static objective arguments are sent to each worker once
+            with Pool(n_procs, initializer=_init_outlet_bc_worker, initargs=(objective_args,)) as p:
+                def parallel_grad(resistances):
+                    '''
+                    forward difference gradient of the objective function, with the perturbed
+                    simulations run in parallel
+                    '''
+                    x = np.asarray(resistances, dtype=float)
+                    # the base point has almost always just been evaluated by the optimizer
+                    f0 = zerod_optimization_objective(x)
+                    # same relative step size as the scipy default for finite difference gradients
+                    h = np.sqrt(np.finfo(float).eps) * np.maximum(1.0, np.abs(x))
+                    perturbed = [x + h[i] * np.eye(len(x))[i] for i in range(len(x))]
+
+                    f = p.map(_outlet_bc_worker_objective, perturbed)
+
+                    return (np.array(f) - f0) / h
+
+                result = run_optimizer(jac=parallel_grad)
     else:
-        bounds = Bounds(lb=0, ub=math.inf)
-        result = minimize(zerod_optimization_objective,
-                          initial_r,
-                          args=(config_handler.config, 
-                                clinical_targets.mpa_p, 
-                                steady, 
-                                result_handler.lpa_branch, 
-                                result_handler.rpa_branch, 
-                                clinical_targets.rpa_split),
-                          method="Nelder-Mead",
-                          options={"disp": False},
-                          bounds=bounds
-                          )
-        
+        result = run_optimizer()
+
+    if show_optimization:
+        plot_optimization_progress(obj_fun_history())
+
     log_optimization_results(log_file, result, '0D optimization')
     # write to log file for debugging
     write_to_log(log_file, "Outlet resistances optimized! " + str(result.x))
 
     R_final = result.x # get the array of optimized resistances 
-    write_resistances(config_handler.config, R_final)
+    _write_outlet_bc_values(outlet_bcs, R_final, rcr=not steady)
 
 
     return config_handler, result_handler
 
 
+def _outlet_bc_objective(resistances,
+                         config_handler,
+                         outlet_bcs,
+                         target_ps=None,
+                         steady=True,
+                         rpa_branch=None,
+                         q_rpa_target=None):
+    '''
+    objective function for 0D boundary condition optimization. defined at the module level so that it can be
+    sent to worker processes when the finite difference gradient is computed in parallel
+
+    :param resistances: list of resistances or RCR values, given by the optimizer
+    :param config_handler: ConfigHandler of the simulation to be optimized
+    :param outlet_bcs: list of the outlet BoundaryCondition instances of config_handler
+    :param target_ps: target pressures to optimize against
+    :param steady: False if the model to be optimized has an unsteady inflow condition
+    :param rpa_branch: rpa branch id
+    :param q_rpa_target: target mean rpa flow, the target flow split times the mean inflow
+
+    :return: sum of SSE of pressure targets and flow split targets
+    '''
+    print("resistances: ", resistances)
+    # write the optimization iteration resistances to the outlet bcs
+    _write_outlet_bc_values(outlet_bcs, resistances, rcr=not steady)
+        
+    zerod_result = run_svzerodplus(config_handler.config)
+
+    return _outlet_bc_loss(zerod_result, outlet_bcs, target_ps, steady, rpa_branch, q_rpa_target)
+
+
+def _time_average(y, t):
+    '''
+    time average of a waveform over its time points. unlike the sample mean, this does not double count the repeated
+    endpoint of a periodic waveform, and it equals the sample mean for a constant waveform
+
+    :param y: waveform values
+    :param t: time points of the waveform
+
+    :return: time averaged value
+    '''
+    y = np.asarray(y, dtype=np.float64)
+    t = np.asarray(t, dtype=np.float64)
+
+    if t.size < 2 or t.size != y.size or t[-1] == t[0]:
+        return float(np.mean(y))
+
+    return float(trapz(y, t) / (t[-1] - t[0]))
+
+
+# static arguments of the outlet bc objective in a pool worker, set once by _init_outlet_bc_worker
+_outlet_bc_worker_args = None
+
+
+def _init_outlet_bc_worker(objective_args):
+    '''
+    pool initializer which stores the static outlet bc objective arguments in the worker, so that only the
+    resistances are sent with each task
+
+    :param objective_args: tuple of the arguments of _outlet_bc_objective after the resistances
+    '''
+    global _outlet_bc_worker_args
+    _outlet_bc_worker_args = objective_args
+
+
+def _outlet_bc_worker_objective(resistances):
+    '''
+    outlet bc objective in a pool worker initialized with _init_outlet_bc_worker
+
+    :param resistances: list of resistances or RCR values
+
+    :return: sum of SSE of pressure targets and flow split targets
+    '''
+
+    return _outlet_bc_objective(resistances, *_outlet_bc_worker_args)
+
+
+def _outlet_bc_loss(zerod_result,
+                    outlet_bcs,
+                    target_ps=None,
+                    steady=True,
+                    rpa_branch=None,
+                    q_rpa_target=None):
+    '''
+    compute the outlet bc optimization loss from a formatted 0D result
+
+    :param zerod_result: result of run_svzerodplus
+    :param outlet_bcs: list of the outlet BoundaryCondition instances the result was computed with
+    :param target_ps: target pressures to optimize against
+    :param steady: False if the model to be optimized has an unsteady inflow condition
+    :param rpa_branch: rpa branch id
+    :param q_rpa_target: target mean rpa flow, the target flow split times the mean inflow
+
+    :return: sum of SSE of pressure targets and flow split targets
+    '''
+
+    # get mean, systolic and diastolic pressures
+    mpa_pressures, mpa_sys_p, mpa_dia_p, mpa_mean_p  = get_pressure(zerod_result, branch=0, convert_to_mmHg=True)
+
+    # time averaged RPA flow rate, averaged the same way as the target so the two are comparable. the result time
+    # column repeats the time points for every vessel, so take the unique points as the branch time grid
+    q_RPA = get_branch_result(zerod_result, branch=rpa_branch, data_name='flow_in', steady=False)
+    q_rpa_mean = _time_average(q_RPA, np.unique(np.asarray(zerod_result['time'], dtype=np.float64)))
+
+    if not steady:
+        print("pred_p: ", [-mpa_sys_p, -mpa_dia_p])
+
+    # sum of pressure SSE and flow split SSE
+    min_obj = _compute_obj(q_rpa_mean,
+                           np.atleast_1d(np.asarray(target_ps, dtype=np.float64)),
+                           float(q_rpa_target),
+                           float(mpa_sys_p),
+                           float(mpa_dia_p),
+                           float(mpa_mean_p),
+                           steady)
+
+    if not steady:
+        # penalize small resistances
+        min_obj += np.sum(np.array([1 / bc.Rp for bc in outlet_bcs]) ** 2) + \
+                   np.sum(np.array([1 / bc.Rd for bc in outlet_bcs]) ** 2)
+
+    return min_obj
+
+
+def _write_outlet_bc_values(outlet_bcs, vals, rcr: bool):
+    '''
+    write the optimizer values directly to the outlet boundary conditions
+
+    :param outlet_bcs: list of outlet BoundaryCondition instances
+    :param vals: list of values to change the boundary conditions to, with either R or Rp, C, Rd values
+    :param rcr: bool to indicate if changing RCR or R BCs
+    '''
+
+    if rcr:
+        for idx, bc in enumerate(outlet_bcs):
+            bc.Rp = float(vals[idx * 3])
+            bc.C = float(vals[idx * 3 + 1])
+            bc.Rd = float(vals[idx * 3 + 2])
+    else:
+        for bc, R in zip(outlet_bcs, vals):
+            bc.R = float(R)
+
+
+@njit(cache=True)
+def _compute_obj(q_rpa_mean, target_ps, q_rpa_target, mpa_sys_p, mpa_dia_p, mpa_mean_p, steady):
+    '''
+    compute the pressure and flow split terms of the outlet boundary condition objective function
+
+    :param q_rpa_mean: time averaged RPA flow
+    :param target_ps: array of target pressures, [sys, dia, mean] or [mean]
+    :param q_rpa_target: target mean rpa flow
+    :param mpa_sys_p: MPA systolic pressure
+    :param mpa_dia_p: MPA diastolic pressure
+    :param mpa_mean_p: MPA mean pressure
+    :param steady: False if the model has an unsteady inflow condition
+
+    :return: sum of SSE of pressure targets and flow split targets
+    '''
+    if steady: # take the mean pressure only
+        if target_ps.size > 2:
+            p_diff = (target_ps[2] - mpa_mean_p) ** 2
+        else:
+            p_diff = (target_ps[0] - mpa_mean_p) ** 2
+    else: # if unsteady, take sum of squares of sys, dia pressure
+        p_diff = (-mpa_sys_p - target_ps[0]) ** 2 + (-mpa_dia_p - target_ps[0]) ** 2
+
+    # add flow split to optimization by checking RPA flow against flow split
+    RPA_diff = (q_rpa_mean - q_rpa_target) ** 2
+
+    return p_diff + RPA_diff
+
+
 def optimize_pa_bcs(input_file,
                     mesh_surfaces_path,
                     clinical_targets: csv,
@@ -234,6 +481,17 @@ def optimize_pa_bcs(input_file,
     pa_config = PAConfig.from_config_handler(config_handler, clinical_targets)
 
 
+    # the model topology is fixed, so find the outlet branches downstream of the lpa and rpa once
+    lpa_branch = config_handler.lpa.branch
+    rpa_branch = config_handler.rpa.branch
+    outlet_vessels = [vessel for vessel in config_handler.vessel_map.values() if vessel.bc is not None and "outlet" in vessel.bc]
+    lpa_outlets = [vessel.branch for vessel in outlet_vessels if lpa_branch in vessel.path]
+    rpa_outlets = [vessel.branch for vessel in outlet_vessels 
+                   if lpa_branch not in vessel.path and rpa_branch in vessel.path]
+
+    # get outlet areas, which also do not change between iterations
+    rpa_info, lpa_info, inflow_info = vtp_info(mesh_surfaces_path)
+
     iterations = 1
 
     for i in range(iterations):
@@ -248,17 +506,14 @@ def optimize_pa_bcs(input_file,
         write_to_log(log_file, "LPA pressure: " + str(pa_config.P_lpa))
         write_to_log(log_file, "RPA flow split: " + str(pa_config.Q_rpa / clinical_targets.q))
 
-        # get outlet areas
-        rpa_info, lpa_info, inflow_info = vtp_info(mesh_surfaces_path)
-
         assign_pa_bcs(config_handler, pa_config, rpa_info, lpa_info, steady=steady)
 
         # run the simulation
         result = run_svzerodplus(config_handler.config)
 
         # get the actual Q_lpa and Q_rpa
-        Q_lpa = get_branch_result(result, 'flow_in', config_handler.lpa.branch, steady=steady)
-        Q_rpa = get_branch_result(result, 'flow_in', config_handler.rpa.branch, steady=steady)
+        Q_lpa = get_branch_result(result, 'flow_in', lpa_branch, steady=steady)
+        Q_rpa = get_branch_result(result, 'flow_in', rpa_branch, steady=steady)
 
         flow_split = np.mean(Q_rpa) / (np.mean(Q_lpa) + np.mean(Q_rpa))
         print('\n actual flow split:  ' + str(flow_split))
@@ -266,35 +521,27 @@ def optimize_pa_bcs(input_file,
         if abs(flow_split - clinical_targets.rpa_split) < 0.01:
             print('\n flow split within tolerance')
             break
-        else:
-            print('\n flow split not within tolerance, adjusting resistance values')
-            # get the mean outlet pressure
-            p_out_RPA = []
-            p_out_LPA = []
-            for vessel in config_handler.vessel_map.values():
-                if vessel.bc is not None:
-                    if "outlet" in vessel.bc:
-                        if config_handler.lpa.branch in vessel.path:
-                            p_out_LPA.append(np.mean(get_branch_result(result, 'pressure_out', vessel.branch, steady=steady)))
-                        elif config_handler.rpa.branch in vessel.path:
-                            p_out_RPA.append(np.mean(get_branch_result(result, 'pressure_out', vessel.branch, steady=steady)))
-            
-            p_mean_out_LPA = np.mean(p_out_LPA)
-            p_mean_out_RPA = np.mean(p_out_RPA)
-            print(d2m(p_mean_out_LPA), d2m(p_mean_out_RPA))
 
-            R_eq_LPA_dist = (get_branch_result(result, 'pressure_out', config_handler.lpa.branch, steady=steady) - p_mean_out_LPA) / Q_lpa
-            R_eq_RPA_dist = (get_branch_result(result, 'pressure_out', config_handler.rpa.branch, steady=steady) - p_mean_out_RPA) / Q_rpa
+        print('\n flow split not within tolerance, adjusting resistance values')
+        # get the mean outlet pressure
+        p_out_LPA = [np.mean(get_branch_result(result, 'pressure_out', branch, steady=steady)) for branch in lpa_outlets]
+        p_out_RPA = [np.mean(get_branch_result(result, 'pressure_out', branch, steady=steady)) for branch in rpa_outlets]
 
-            print(R_eq_LPA_dist, R_eq_RPA_dist)
+        p_mean_out_LPA = np.mean(p_out_LPA)
+        p_mean_out_RPA = np.mean(p_out_RPA)
+        print(d2m(p_mean_out_LPA), d2m(p_mean_out_RPA))
 
-            # adjust the resistance values
-            pa_config.lpa_dist.R = R_eq_LPA_dist
-            pa_config.rpa_dist.R = R_eq_RPA_dist
+        R_eq_LPA_dist = (get_branch_result(result, 'pressure_out', lpa_branch, steady=steady) - p_mean_out_LPA) / Q_lpa
+        R_eq_RPA_dist = (get_branch_result(result, 'pressure_out', rpa_branch, steady=steady) - p_mean_out_RPA) / Q_rpa
 
-        
-        print('\n LPA Pressure Drop: ' + str(d2m(config_handler.get_branch_resistance(config_handler.lpa.branch) * Q_lpa)))
-        print('RPA Pressure Drop: ' + str(d2m(config_handler.get_branch_resistance(config_handler.rpa.branch) * Q_rpa)))
+        print(R_eq_LPA_dist, R_eq_RPA_dist)
+
+        # adjust the resistance values
+        pa_config.lpa_dist.R = R_eq_LPA_dist
+        pa_config.rpa_dist.R = R_eq_RPA_dist
+
+        print('\n LPA Pressure Drop: ' + str(d2m(config_handler.get_branch_resistance(lpa_branch) * Q_lpa)))
+        print('RPA Pressure Drop: ' + str(d2m(config_handler.get_branch_resistance(rpa_branch) * Q_rpa)))
 
 
     return config_handler, result_handler, pa_config
@@ -313,41 +560,24 @@ def assign_pa_bcs(config_handler, pa_config, rpa_info, lpa_info, steady=True):
     :param R_lpa: LPA outlet resistance value
     '''
 
-    def Ri(Ai, A, R):
-        return R * (A / Ai)
-    
-    if not steady:
-        def Ci(Ai, A, C):
-            return C * (Ai / A)
+    # get RPA and LPA outlet areas
+    lpa_areas = np.fromiter(lpa_info.values(), dtype=np.float64, count=len(lpa_info))
+    rpa_areas = np.fromiter(rpa_info.values(), dtype=np.float64, count=len(rpa_info))
 
     # get RPA and LPA total area
-    a_RPA = sum(rpa_info.values())
-    a_LPA = sum(lpa_info.values())
+    a_RPA = rpa_areas.sum()
+    a_LPA = lpa_areas.sum()
 
-    # initialize list of resistances
-    all_R = {}
-    if not steady: 
-        all_C = {}
+    # resistances are inversely proportional to outlet area, LPA outlets first and then RPA
+    R_list = np.empty(lpa_areas.size + rpa_areas.size)
+    _proportional_R(lpa_areas, a_LPA, pa_config.bcs["LPA_BC"].R, R_list[:lpa_areas.size])
+    _proportional_R(rpa_areas, a_RPA, pa_config.bcs["RPA_BC"].R, R_list[lpa_areas.size:])
 
     # TODO: NEED TO ADD CAPACITANCE DISTRIBUTION BELOW
-
-    for name, val in lpa_info.items():
-        all_R[name] = Ri(val, a_LPA, pa_config.bcs["LPA_BC"].R)
-        if not steady:
-            all_C[name] = Ci(val, a_LPA, pa_config.bcs["LPA_BC"].C)
-
-    for name, val in rpa_info.items():
-        all_R[name] = Ri(val, a_RPA, pa_config.bcs["RPA_BC"].R)
-        if not steady: 
-            all_C[name] = Ci(val, a_RPA, pa_config.bcs["RPA_BC"].C)
-
-    # write the resistances to the config
-    bc_idx = 0
-
-    # get all resistance values
-    R_list = list(all_R.values())
-    if not steady: 
-        C_list = list(all_C.values())
+    if not steady:
+        # capacitances are proportional to outlet area
+        C_list = np.concatenate((pa_config.bcs["LPA_BC"].C * lpa_areas / a_LPA,
+                                 pa_config.bcs["RPA_BC"].C * rpa_areas / a_RPA))
 
     # change the proximal LPA and RPA branch resistances
     config_handler.change_branch_resistance(config_handler.lpa.branch, pa_config.lpa_prox.R)
@@ -359,19 +589,31 @@ def assign_pa_bcs(config_handler, pa_config, rpa_info, lpa_info, steady=True):
     print('RPA RESISTANCE: ' + str(config_handler.get_branch_resistance(config_handler.rpa.branch)))
     print('PREDICTED RPA PRESSURE DROP: ' + str(d2m(config_handler.get_branch_resistance(config_handler.rpa.branch) * pa_config.clinical_targets.q * .39)))
 
-    # loop through boundary conditions to assign resistance values
-    for bc in config_handler.bcs.values():
+    # loop through the outlet boundary conditions to assign resistance values
+    for bc_idx, (name, bc) in enumerate(config_handler.resistance_bcs):
         if bc.type == 'RESISTANCE':
-            bc.R = R_list[bc_idx]
+            bc.R = float(R_list[bc_idx])
             bc.values['Pd'] = pa_config.clinical_targets.wedge_p * 1333.22 # convert wedge pressure from mmHg to dyn/cm2
-            bc_idx += 1
     
         elif bc.type == 'RCR':
             # split the resistance
-            bc.Rp = R_list[bc_idx] * 0.1
-            bc.C = C_list[bc_idx]
-            bc.Rd = R_list[bc_idx] * 0.9
-            bc_idx += 1
+            bc.Rp = float(R_list[bc_idx]) * 0.1
+            bc.C = float(C_list[bc_idx])
+            bc.Rd = float(R_list[bc_idx]) * 0.9
+
+
+@njit(cache=True)
+def _proportional_R(areas, A_total, R_total, out):
+    '''
+    distribute a total resistance over outlets inversely proportional to their area
+
+    :param areas: array of outlet areas
+    :param A_total: total outlet area
+    :param R_total: total resistance to distribute
+    :param out: array to write the outlet resistances to
+    '''
+    for i in range(areas.size):
+        out[i] = R_total * A_total / areas[i]
 
 
 def construct_cwss_trees(config_handler, result_handler, n_procs=4, log_file=None, d_min=0.0049):
@@ -379,6 +621,9 @@ def construct_cwss_trees(config_handler, result_handler, n_procs=4, log_file=Non
     construct cwss trees in parallel to increase computational speed
     '''
 
+    # build all of the outlet trees first, keeping track of the bc each tree belongs to
+    trees = []
+    outlet_bcs = []
     for vessel in config_handler.vessel_map.values():
         if vessel.bc is not None:
             if "outlet" in vessel.bc:
@@ -389,23 +634,26 @@ def construct_cwss_trees(config_handler, result_handler, n_procs=4, log_file=Non
                                                                       config_handler.simparams,
                                                                       bc)
                 
-                config_handler.trees[bc.name] = outlet_tree
-
-
-    
-    # function to run the tree diameter optimization
-    def optimize_tree(tree):
-        print('building ' + tree.name + ' for resistance ' + str(tree.params["bc_values"]["R"]) + '...')
-        tree.optimize_tree_diameter(log_file=log_file, d_min=d_min)
-        return tree
-
-    # run the tree 
-    with Pool(n_procs) as p:
-        # TODO: fix this
-        config_handler.trees = p.map(optimize_tree, list(config_handler.trees.values()))
+                trees.append(outlet_tree)
+                outlet_bcs.append(bc)
+
+    # run the tree diameter optimization in parallel. optimization time varies between trees, so results are
+    # streamed back as they finish and put back in outlet order using the tree index. the trees are sent unbuilt
+    # and only the optimized diameter is sent back, so the full vessel graphs are never pickled
+    chunksize = max(1, len(trees) // (4 * n_procs))
+    with Pool(n_procs, maxtasksperchild=1) as p:
+        for idx, d_opt in p.imap_unordered(partial(_optimize_indexed_tree_diameter, log_file=log_file, d_min=d_min), 
+                                           enumerate(trees), 
+                                           chunksize=chunksize):
+            # rebuild the tree at the optimized diameter in the main process. this is one build, against the many
+            # builds of the optimization, and it overlaps the workers still optimizing. sending the built tree back
+            # instead is much slower, since pickling a tree takes about 15 times as long as building it
+            trees[idx].build_tree(initial_d=d_opt, d_min=d_min, optimizing=True)
+
+    config_handler.trees = trees
     
     # update the resistance in the config according to the optimized tree resistance
-    for bc, tree in zip(list(config_handler.bcs.values())[1:], list(config_handler.trees.values())):
+    for bc, tree in zip(outlet_bcs, config_handler.trees):
         bc.R = tree.root.R_eq
 
 
@@ -435,17 +683,18 @@ def construct_pries_trees(config_handler: ConfigHandler, result_handler,  n_proc
     :param vis_trees: boolean for visualizing trees
     :param fig_dir: [optional path to directory to save figures. Required if vis_trees = True.
     '''
-    simparams = config_handler.config["simulation_parameters"]
-    num_outlets = len(config_handler.config["boundary_conditions"])
+    # assemble the config once for the pretree simulation and the outlet data
+    config = config_handler.config
 
     # compute a pretree result to use to optimize the trees
-    pretree_result = run_svzerodplus(config_handler.config)
+    pretree_result = run_svzerodplus(config)
 
     # get the outlet flowrate
-    q_outs = get_outlet_data(config_handler.config, pretree_result, "flow_out", steady=True)
-    p_outs = get_outlet_data(config_handler.config, pretree_result, "pressure_out", steady=True)
-    tsteps = get_outlet_data(config_handler.config, pretree_result, "time", steady=True)
+    q_outs = get_outlet_data(config, pretree_result, "flow_out", steady=True)
+    p_outs = get_outlet_data(config, pretree_result, "pressure_out", steady=True)
     outlet_idx = 0 # need this when iterating through outlets 
+    trees = []
+    outlet_bcs = []
     # get the outlet vessel
     for vessel in config_handler.vessel_map.values():
         if vessel.bc is not None:
@@ -459,30 +708,23 @@ def construct_pries_trees(config_handler: ConfigHandler, result_handler,  n_proc
                                                                       P_outlet=p_outs[outlet_idx],
                                                                       Q_outlet=q_outs[outlet_idx],)
                 
-                config_handler.trees[bc.name] = outlet_tree
+                trees.append(outlet_tree)
+                outlet_bcs.append(bc)
                 # count up the outlets for indexing pressure and flow
                 outlet_idx += 1
 
 
+    build_tree = partial(_optimize_tree_worker, log_file=log_file, d_min=d_min, pries_secomb=True)
     if n_procs is None:
         # don't run as parallel processes
-        for tree in config_handler.trees.values():
-            print('building ' + tree.name + ' for resistance ' + str(tree.params["bc_values"]["R"]) + '...')
-            tree.optimize_tree_diameter(log_file, d_min=d_min, pries_secomb=True)
+        config_handler.trees = [build_tree(tree) for tree in trees]
     else:
         # run as a parallel process
-        def build_tree(tree):
-            print('building ' + tree.name + ' for resistance ' + str(tree.params["bc_values"]["R"]) + '...')
-            tree.optimize_tree_diameter(log_file, d_min=d_min, pries_secomb=True)
-            return tree
-
-
         with Pool(n_procs) as p:
-            # TODO: FIX THIS
-            config_handler.trees = p.map(build_tree, list(config_handler.trees.values()))
+            config_handler.trees = p.map(build_tree, trees)
     
     # update the resistance in the config according to the optimized tree resistance
-    for bc, tree in zip(list(config_handler.bcs.values())[1:], list(config_handler.trees.values())):
+    for bc, tree in zip(outlet_bcs, config_handler.trees):
         bc.R = tree.root.R_eq
 
 
@@ -493,7 +735,7 @@ def construct_pries_trees(config_handler: ConfigHandler, result_handler,  n_proc
     config_handler.update_stree_hemodynamics(preop_result)
 
     if n_procs is None:
-        for tree in list(config_handler.trees.values()):
+        for tree in config_handler.trees:
             tree.pries_n_secomb.optimize_params()
     else:
         # parallel the parameter optimization for Pries and Secomb adaptation
@@ -503,8 +745,7 @@ def construct_pries_trees(config_handler: ConfigHandler, result_handler,  n_proc
             return tree
         
         with Pool(n_procs) as p:
-            # TODO: FIX THIS
-            config_handler.trees = p.map(optimize_params, list(config_handler.trees.values()))
+            config_handler.trees = p.map(optimize_params, config_handler.trees)
     
 
 
@@ -512,6 +753,42 @@ def construct_pries_trees(config_handler: ConfigHandler, result_handler,  n_proc
     result_handler.add_unformatted_result(preop_result, 'preop')
 
 
+def _optimize_tree_worker(tree, log_file=None, d_min=0.0049, pries_secomb=False):
+    '''
+    optimize the diameter of a single outlet tree. defined at the module level so that it can be
+    mapped over a process pool
+
+    :param tree: StructuredTree instance to optimize
+    :param log_file: optional path to a log file
+    :param d_min: minimum vessel diameter for tree optimization
+    :param pries_secomb: True if the tree will undergo pries and secomb adaptation
+
+    :return: the optimized StructuredTree instance
+    '''
+    print('building ' + tree.name + ' for resistance ' + str(tree.params["bc_values"]["R"]) + '...')
+    tree.optimize_tree_diameter(log_file=log_file, d_min=d_min, pries_secomb=pries_secomb)
+
+    return tree
+
+
+def _optimize_indexed_tree_diameter(indexed_tree, **kwargs):
+    '''
+    optimize the diameter of an outlet tree which is tagged with its outlet index, so that results returned out of order
+    can be reassembled. only the optimized root diameter is returned, so the built tree does not need to be sent back
+    to the main process
+
+    :param indexed_tree: tuple of (outlet index, StructuredTree instance)
+    :param kwargs: keyword arguments to _optimize_tree_worker
+
+    :return: tuple of (outlet index, optimized root diameter)
+    '''
+    idx, tree = indexed_tree
+
+    tree = _optimize_tree_worker(tree, **kwargs)
+
+    return idx, tree.initial_d
+
+
 def construct_coupled_cwss_trees(config_handler, simulation_dir, n_procs=4, d_min=.0049):
     '''
     construct cwss trees for a 3d coupled BC'''
@@ -521,10 +798,13 @@ def construct_coupled_cwss_trees(config_handler, simulation_dir, n_procs=4, d_mi
     for coupling_block in config_handler.coupling_blocks.values():
         coupling_block.surface = coupled_surfs[coupling_block.name]
 
+    trees = []
+    outlet_bcs = []
     for bc in config_handler.bcs.values():
         if config_handler.coupling_blocks[bc.name].location == 'inlet':
             diameter = (find_vtp_area(config_handler.coupling_blocks[bc.name].surface) / np.pi)**(1/2) * 2
-            config_handler.trees[bc.name] = StructuredTree.from_bc_config(bc, config_handler.simparams, diameter)
+            trees.append(StructuredTree.from_bc_config(bc, config_handler.simparams, diameter))
+            outlet_bcs.append(bc)
 
 
     # function to run the tree diameter optimization
@@ -535,20 +815,17 @@ def construct_coupled_cwss_trees(config_handler, simulation_dir, n_procs=4, d_mi
 
     # run the tree 
     with Pool(n_procs) as p:
-        config_handler.trees = p.map(optimize_tree, list(config_handler.trees.values()))
+        config_handler.trees = p.map(optimize_tree, trees)
     
 
     # update the resistance in the config according to the optimized tree resistance
-    outlet_idx = 0 # linear search, i know. its bad. will fix later
-    for bc in config_handler.bcs.values():
-        # we assume that an inlet location indicates taht this is an outlet bc and threfore undergoes adaptation
-        if config_handler.coupling_blocks[bc.name].location == 'inlet':
-            if bc.type == 'RCR':
-                bc.Rp = config_handler.trees[bc.name].root.R_eq * 0.1
-                bc.Rd = config_handler.trees[bc.name].root.R_eq * 0.9
-            elif bc.type == 'RESISTANCE':
-                bc.R = config_handler.trees[bc.name].root.R_eq
-            outlet_idx += 1
+    # we assume that an inlet location indicates that this is an outlet bc and therefore undergoes adaptation
+    for bc, tree in zip(outlet_bcs, config_handler.trees):
+        if bc.type == 'RCR':
+            bc.Rp = tree.root.R_eq * 0.1
+            bc.Rd = tree.root.R_eq * 0.9
+        elif bc.type == 'RESISTANCE':
+            bc.R = tree.root.R_eq
 
 
 def construct_impedance_trees(config_handler, mesh_surfaces_path, wedge_pressure, d_min = 0.1, convert_to_cm=False, is_pulmonary=True, tree_params={'lpa': [19992500, -35, 0.0, 50.0], 
@@ -706,9 +983,13 @@ def optimize_impedance_bcs(config_handler, mesh_surfaces_path, clinical_targets,
     # rescale inflow by number of outlets ## TODO: figure out scaling for this
     pa_config.bcs['INFLOW'].Q = [q / ((len(lpa_info.values()) + len(rpa_info.values())) // 2) for q in pa_config.bcs['INFLOW'].Q]
 
+    # the tuning config is only written for the first evaluation, as a checkpoint of the setup
+    tuning_config_dumped = False
+
     def tree_tuning_objective(params, clinical_targets, lpa_mean_dia, rpa_mean_dia, d_min, n_procs):
         '''
         params: [k1_l, k1_r, k2_l, k2_r, lrr_l, lrr_r, alpha]'''
+        nonlocal tuning_config_dumped
 
         # k1_l = params[0]
         # k1_r = params[1]
@@ -752,7 +1033,9 @@ def optimize_impedance_bcs(config_handler, mesh_surfaces_path, clinical_targets,
 
         pa_config.create_impedance_trees(lpa_mean_dia, rpa_mean_dia, d_min, tree_params, n_procs)
 
-        pa_config.to_json(f'pa_config_test_tuning.json')
+        if not tuning_config_dumped:
+            pa_config.to_json(f'pa_config_test_tuning.json')
+            tuning_config_dumped = True
 
         if pa_config.bcs['LPA_BC'].Z[0] != pa_config.bcs['LPA_BC'].Z[0]:
             print('NaN in LPA impedance')
@@ -900,6 +1183,166 @@ class ClinicalTargets():
         write_to_log(log_file, "RPA flow split: " + str(self.rpa_split))
 
 
+@njit(cache=True, fastmath=True)
+def _loss_l2(d, inv_R):
+    '''
+    sum of squares loss of the pa config targets
+
+    :param d: array of differences between the simulated values and the targets
+    :param inv_R: array of reciprocal resistances, to penalize small resistances
+
+    :return: sum of squares of d and inv_R
+    '''
+    s = 0.0
+    for i in range(d.size):
+        s += d[i] * d[i]
+    for i in range(inv_R.size):
+        s += inv_R[i] * inv_R[i]
+    return s
+
+
+@njit(cache=True, fastmath=True)
+def _loss_l1(d):
+    '''
+    sum of absolute values loss of the pa config targets
+
+    :param d: array of differences between the simulated values and the targets
+
+    :return: sum of absolute values of d
+    '''
+    s = 0.0
+    for i in range(d.size):
+        s += abs(d[i])
+    return s
+
+
+def _extract_steady(result):
+    '''
+    get the mean pressures and rpa flow of a pa config simulation in a single pass over the result
+
+    :param result: pa config simulation result dataframe
+
+    :return: tuple of mpa, rpa and lpa mean pressures (mmHg) and the mean rpa flow
+    '''
+    means = result[result['name'].isin(('branch0_seg0', 'branch1_seg0', 'branch3_seg0'))].groupby('name')[
+        ['flow_in', 'pressure_in', 'pressure_out']].mean()
+
+    # mpa inlet pressure, rpa and lpa outlet pressures
+    P_mpa, P_rpa, P_lpa = np.multiply([means.at['branch0_seg0', 'pressure_in'], 
+                                       means.at['branch3_seg0', 'pressure_out'], 
+                                       means.at['branch1_seg0', 'pressure_out']], _INV_MMHG)
+
+    # rpa flow, for flow split optimization
+    Q_rpa = means.at['branch3_seg0', 'flow_in']
+
+    return P_mpa, P_rpa, P_lpa, Q_rpa
+
+
+def _extract_unsteady(result):
+    '''
+    get the pressure waveform summaries and the time averaged rpa flow of a pa config simulation
+
+    :param result: pa config simulation result dataframe
+
+    :return: tuple of [max, min, mean] mpa, rpa and lpa pressures (mmHg) and the time averaged rpa flow
+    '''
+    mpa = result[result['name'] == 'branch0_seg0']
+    rpa = result[result['name'] == 'branch3_seg0']
+    lpa = result[result['name'] == 'branch1_seg0']
+
+    # mpa inlet pressure, rpa and lpa outlet pressures, as in _extract_steady
+    pressures = []
+    for p in (mpa['pressure_in'], rpa['pressure_out'], lpa['pressure_out']):
+        p = p.to_numpy() * _INV_MMHG
+        pressures.append([np.max(p), np.min(p), np.mean(p)])
+
+    # rpa flow, for flow split optimization
+    t = rpa['time'].to_numpy()
+    Q_rpa = trapz(rpa['flow_in'].to_numpy(), t) / (t[-1] - t[0])
+
+    return pressures[0], pressures[1], pressures[2], Q_rpa
+
+
+# pa config of a pool worker, set once by _init_pa_worker
+_pa_worker_config = None
+
+
+def _init_pa_worker(pa_config):
+    '''
+    pool initializer which stores a copy of the pa config in the worker, so that only the resistances are sent with
+    each task and the worker keeps its solver between tasks
+
+    :param pa_config: PAConfig instance
+    '''
+    global _pa_worker_config
+    _pa_worker_config = pa_config
+
+
+def _pa_worker_residuals(R_guess):
+    '''
+    steady residuals of the pa config in a pool worker initialized with _init_pa_worker
+
+    :param R_guess: list of resistances to put into the config
+
+    :return: array of steady residuals
+    '''
+
+    return _pa_worker_config.compute_steady_residuals(R_guess)
+
+
+def _scaled_simplex(x0, rel_step=0.5):
+    '''
+    initial Nelder-Mead simplex with each vertex perturbing one parameter by a fraction of its own value, so that
+    parameters with very different magnitudes are explored on their own scale
+
+    :param x0: initial guess
+    :param rel_step: perturbation as a fraction of each parameter
+
+    :return: array of shape (n + 1, n) with the simplex vertices
+    '''
+    x0 = np.asarray(x0, dtype=np.float64)
+
+    step = rel_step * x0
+    # same step as scipy's default simplex for parameters which are zero
+    step[step == 0.0] = 0.00025
+
+    return np.vstack((x0, x0 + np.diag(step)))
+
+
+class _EarlyStopAtMinLoss():
+    '''
+    scipy.optimize.minimize callback which stops the optimization once the best loss has not improved by more than
+    tol for patience consecutive iterations
+    '''
+
+    def __init__(self, tol=1e-6, patience=10, progress=None):
+        '''
+        :param tol: minimum decrease in the best loss which counts as an improvement
+        :param patience: number of iterations without improvement before stopping
+        :param progress: optional function called with the current best parameters each iteration
+        '''
+        self.tol = tol
+        self.patience = patience
+        self.progress = progress
+        self.best = np.inf
+        self.n_stalled = 0
+
+    def __call__(self, intermediate_result):
+        # scipy passes an OptimizeResult with the current best x and fun when the argument has this name
+        if self.progress is not None:
+            self.progress(intermediate_result.x)
+
+        if self.best - intermediate_result.fun > self.tol:
+            self.best = intermediate_result.fun
+            self.n_stalled = 0
+        else:
+            self.n_stalled += 1
+
+        if self.n_stalled >= self.patience:
+            # minimize stops and returns the current best result
+            raise StopIteration
+
+
 class PAConfig():
     '''
     a class to handle the reduced pa config for boundary condition optimization
@@ -946,12 +1389,31 @@ class PAConfig():
 
         self.clinical_targets = clinical_targets
 
+        # steady optimization targets, and the index into [P_mpa, P_rpa, P_lpa, Q_rpa] each one is compared against
+        self._steady_targets, self._steady_target_idx = self._get_steady_targets()
+
+        # compile the loss functions now rather than in the first optimization iteration
+        _loss_l2(np.zeros(1), np.ones(1))
+        _loss_l1(np.zeros(1))
+
         self.steady = steady
 
+        # print the optimization progress every _PRINT_EVERY loss evaluations
+        self.verbose = False
+        self._n_evals = 0
+
         self._config = {}
         self.junctions = {}
         self.vessel_map = {}
         self.bcs = {'INFLOW': inflow}
+        # blocks with the optimized resistances, set once the outlet boundary conditions exist
+        self._opt_blocks = None
+        # array mirror of the optimized resistances, so the resistance penalty is one vector operation
+        self._R_buf = np.empty(4)
+        # persistent solver, reused between simulations while only block parameters change
+        self._solver = None
+        # memoized steady simulations, keyed on the optimized resistances and the rest of the config
+        self._steady_memo = {}
         self.initialize_config_maps()
 
         # need to initialize boundary conditions
@@ -962,9 +1424,10 @@ class PAConfig():
         '''
         initialize from a general config handler
         '''
-        mpa = copy.deepcopy(config_handler.mpa)
-        rpa_prox = copy.deepcopy(config_handler.rpa)
-        lpa_prox = copy.deepcopy(config_handler.lpa)
+        # the children of these vessels are replaced in the pa config, so only the vessels themselves are copied
+        mpa = config_handler.mpa.shallow_clone(id=0, name='branch0_seg0')
+        rpa_prox = config_handler.rpa.shallow_clone(id=3, name='branch3_seg0')
+        lpa_prox = config_handler.lpa.shallow_clone(id=1, name='branch1_seg0')
         rpa_dist = Vessel.from_config({
             "boundary_conditions":{
                 "outlet": "RPA_BC"
@@ -1027,13 +1490,84 @@ class PAConfig():
                      steady=False)
 
 
+    def _get_steady_targets(self):
+        '''
+        flatten the clinical targets used in the steady optimization into one array. the rpa and lpa pressure
+        targets are optional
+
+        :return targets: array of target values
+        :return idx: array of the index into [P_mpa, P_rpa, P_lpa, Q_rpa] that each target is compared against
+        '''
+        targets = []
+        idx = []
+        for i, target in enumerate([self.clinical_targets.mpa_p, 
+                                    self.clinical_targets.rpa_p, 
+                                    self.clinical_targets.lpa_p, 
+                                    getattr(self.clinical_targets, 'q_rpa', None)]):
+            if target is not None:
+                target = np.atleast_1d(np.asarray(target, dtype=np.float64))
+                targets.append(target)
+                idx.append(np.full(target.size, i))
+
+        return np.concatenate(targets), np.concatenate(idx)
+
+
     def to_json(self, output_file):
         '''
         write the config to a json file
         '''
 
-        with open(output_file, 'w') as ff:
-            json.dump(self.config, ff, indent=4)
+        write_json(self.config, output_file)
+
+
+    def __getstate__(self):
+        # the solver cannot be pickled or copied, so it is rebuilt on the first simulation in the new process or copy.
+        # the memoized simulations are not sent along either
+        state = self.__dict__.copy()
+        state['_solver'] = None
+        state['_steady_memo'] = {}
+        return state
+
+
+    def _get_solver(self):
+        '''
+        get the persistent solver for the current config. if only vessel or outlet resistance / RCR parameters have
+        changed since the last simulation, the new parameters are pushed to the existing solver. otherwise (first
+        simulation, a block replaced, or the inflow, junctions or simulation parameters changed) it is rebuilt
+
+        :return: pysvzerod.Solver for the current config
+        '''
+        blocks = [versioned(bc) for bc in self.bcs.values()] + self._vessels_list
+        versions = [block.version for block in blocks]
+        structure = (tuple(block.token for block in blocks),
+                     tuple(junction.version for junction in self._junctions_list),
+                     tuple(self.simparams.__dict__.items()))
+
+        updates = []
+        rebuild = self._solver is None or structure != self._solver_structure
+        if not rebuild:
+            for block, version, prev_version in zip(blocks, versions, self._solver_versions):
+                if version == prev_version:
+                    continue
+                if isinstance(block, Vessel):
+                    # blood vessel parameters in solver order
+                    updates.append((block.name, [block.R, block.C, block.L, block.stenosis_coefficient]))
+                elif block.type in ('RESISTANCE', 'RCR'):
+                    updates.append((block.name, bc_block_params(block.type, block.values)))
+                else:
+                    rebuild = True
+                    break
+
+        if rebuild:
+            self._solver = pysvzerod.Solver(self.config)
+        else:
+            for name, params in updates:
+                self._solver.update_block_params(name, params)
+
+        self._solver_structure = structure
+        self._solver_versions = versions
+
+        return self._solver
 
 
     def simulate(self):
@@ -1041,11 +1575,14 @@ class PAConfig():
         run the simulation with the current config
         '''
 
-        self.result = pysvzerod.simulate(self.config)
+        solver = self._get_solver()
+        solver.run()
+        self.result = solver.get_full_result()
 
         self.rpa_split = np.mean(self.result[self.result.name=='branch3_seg0']['flow_in']) / (np.mean(self.result[self.result.name=='branch0_seg0']['flow_out']))
 
-        self.P_mpa = [np.max(self.result[self.result.name=='branch0_seg0']['pressure_in']) / 1333.2, np.min(self.result[self.result.name=='branch0_seg0']['pressure_in']) / 1333.2, np.mean(self.result[self.result.name=='branch0_seg0']['pressure_in']) / 1333.2]
+        P_mpa = self.result.loc[self.result.name=='branch0_seg0', 'pressure_in'].to_numpy() * _INV_MMHG
+        self.P_mpa = [np.max(P_mpa), np.min(P_mpa), np.mean(P_mpa)]
     
 
     def initialize_resistance_bcs(self, inflow: BoundaryCondition, wedge_p: float):
@@ -1106,6 +1643,17 @@ class PAConfig():
                 })
             }
 
+        self._cache_opt_blocks()
+
+
+    def _cache_opt_blocks(self):
+        '''
+        store the blocks whose resistances are optimized, [lpa_prox, rpa_prox, LPA_BC, RPA_BC], so the loss functions
+        do not look them up on every evaluation. must be called again if the outlet boundary conditions are replaced
+        '''
+
+        self._opt_blocks = (self.lpa_prox, self.rpa_prox, self.bcs['LPA_BC'], self.bcs['RPA_BC'])
+
 
     def create_impedance_trees(self, lpa_d, rpa_d, d_min, tree_params, n_procs):
         '''
@@ -1140,6 +1688,8 @@ class PAConfig():
 
         self.bcs["RPA_BC"] = self.rpa_tree.create_impedance_bc("RPA_BC", 1, self.clinical_targets.wedge_p * 1333.2)
 
+        self._cache_opt_blocks()
+
 
     def initialize_config_maps(self):
         '''
@@ -1178,6 +1728,13 @@ class PAConfig():
             if junction is not None:
                 self.junctions[junction.name] = junction
 
+        # the vessels and junctions are fixed from here on, so keep them in lists for assembling the config. their
+        # changes are tracked so that only what has changed is reassembled or pushed to the solver
+        self._vessels_list = [versioned(vessel) for vessel in self.vessel_map.values()]
+        self._junctions_list = [versioned(junction) for junction in self.junctions.values()]
+        # (version, dict) of each vessel when it was last converted to a dict
+        self._vessel_dicts = [(None, None)] * len(self._vessels_list)
+
         
     def assemble_config(self):
         '''
@@ -1188,13 +1745,16 @@ class PAConfig():
         self._config['boundary_conditions'] = [bc.to_dict() for bc in self.bcs.values()]
 
         # add the junctions
-        self._config['junctions'] = [junction.to_dict() for junction in self.junctions.values()]
+        self._config['junctions'] = [junction.to_dict() for junction in self._junctions_list]
 
         # add the simulation parameters
         self._config['simulation_parameters'] = self.simparams.to_dict()
 
-        # add the vessels
-        self._config['vessels'] = [vessel.to_dict() for vessel in self.vessel_map.values()]
+        # add the vessels, only converting the vessels which have changed since the last assembly
+        for i, vessel in enumerate(self._vessels_list):
+            if self._vessel_dicts[i][0] != vessel.version:
+                self._vessel_dicts[i] = (vessel.version, vessel.to_dict())
+        self._config['vessels'] = [vessel_dict for version, vessel_dict in self._vessel_dicts]
         
 
     def convert_to_cm(self):
@@ -1206,99 +1766,179 @@ class PAConfig():
             vessel.convert_to_cm()
         
 
-    def compute_steady_loss(self, R_guess, fun='L2'):
+    def compute_steady_residuals(self, R_guess):
         '''
-        compute loss compared to the steady inflow optimization targets
-        :param R_f: list of resistances to put into the config
+        compute the residuals of the steady inflow optimization targets, for use with a least squares solver
+
+        :param R_guess: list of resistances to put into the config, [lpa_prox, rpa_prox, LPA_BC, RPA_BC]
+
+        :return residuals: array of mpa, rpa and lpa pressure residuals (mmHg), the rpa flow residual and the
+            reciprocal resistances, which penalize small resistances
         '''
-        blocks_to_optimize = [self.lpa_prox, self.rpa_prox, self.bcs['LPA_BC'], self.bcs['RPA_BC']]
-        for block, R_g in zip(blocks_to_optimize, R_guess):
+        self._R_buf[:] = R_guess
+        R_values = self._R_buf.tolist()
+        for block, R_g in zip(self._opt_blocks, R_values):
             block.R = R_g
-        # run the simulation
-        self.result = self.simulate()
 
-        # get the pressures
-        # rpa flow, for flow split optimization
-        self.Q_rpa = get_branch_result(self.result, 'flow_in', 3, steady=True)
+        # run the simulation, unless these resistances have already been simulated
+        self.P_mpa, self.P_rpa, self.P_lpa, self.Q_rpa = self._simulate_and_extract(tuple(round(R_g, 10) for R_g in R_values))
+
+        obs = np.array([self.P_mpa, self.P_rpa, self.P_lpa, self.Q_rpa])
+        # penalize small resistances
+        inv_R = np.reciprocal(self._R_buf)
+
+        return np.concatenate((obs[self._steady_target_idx] - self._steady_targets, inv_R))
+
+
+    def _simulate_and_extract(self, R_tuple):
+        '''
+        run the simulation and get the steady pressures and rpa flow. memoized per config on the optimized resistances
+        and the state of everything else in the config, so a change to any other block or the simulation parameters
+        is never served a stale result
+
+        :param R_tuple: tuple of the optimized resistances currently set in the config
+
+        :return: tuple of mpa, rpa and lpa mean pressures (mmHg) and the mean rpa flow
+        '''
+        key = (R_tuple, self._memo_signature())
+        if key in self._steady_memo:
+            # restore what simulate() sets so the result and rpa split describe this point, not the last one run
+            steady, self.result, self.rpa_split = self._steady_memo[key]
+            return steady
+
+        # run the simulation
+        self.simulate()
 
-        # mpa pressure
-        self.P_mpa = get_branch_result(self.result, 'pressure_in', 0, steady=True) /  1333.2 
+        if len(self._steady_memo) >= _STEADY_MEMO_SIZE:
+            self._steady_memo.clear()
+        steady = _extract_steady(self.result)
+        self._steady_memo[key] = (steady, self.result, self.rpa_split)
 
-        # rpa pressure
-        self.P_rpa = get_branch_result(self.result, 'pressure_out', 1, steady=True) / 1333.2
+        return steady
 
-        # lpa pressure
-        self.P_lpa = get_branch_result(self.result, 'pressure_out', 3, steady=True) / 1333.2
 
+    def compute_steady_loss(self, R_guess, fun='L2'):
+        '''
+        compute loss compared to the steady inflow optimization targets
+        :param R_f: list of resistances to put into the config
+        '''
+        residuals = self.compute_steady_residuals(R_guess)
 
+        # the last four residuals are the resistance penalty
         if fun == 'L2':
-            loss = np.sum((self.P_mpa - self.clinical_targets.mpa_p) ** 2) + \
-                np.sum((self.P_rpa - self.clinical_targets.rpa_p) ** 2) + \
-                np.sum((self.P_lpa - self.clinical_targets.lpa_p) ** 2) + \
-                np.sum((self.Q_rpa - self.clinical_targets.q_rpa) ** 2) + \
-                np.sum(np.array([1 / block.R for block in blocks_to_optimize]) ** 2) # penalize small resistances
+            loss = _loss_l2(residuals[:-4], residuals[-4:])
 
         if fun == 'L1':
-            loss = np.sum(np.abs(self.P_mpa - self.clinical_targets.mpa_p)) + \
-                np.sum(np.abs(self.P_rpa - self.clinical_targets.rpa_p)) + \
-                np.sum(np.abs(self.P_lpa - self.clinical_targets.lpa_p)) + \
-                np.sum(np.abs(self.Q_rpa - self.clinical_targets.q_rpa))
+            # the resistance penalty is not included in the L1 loss
+            loss = _loss_l1(residuals[:-4])
         
-        print('R_guess: ' + str(R_guess)) 
-        print('loss: ' + str(loss))
+        self._report_progress(R_guess, loss)
 
         return loss
     
 
-    def compute_unsteady_loss(self, R_guess, fun='L2'):
+    def compute_steady_loss_batch(self, R_batch, fun='L2', n_procs=4):
         '''
-        compute unsteady loss by adjusting the resistances in the proximal lpa and rpa'''
+        compute the steady loss for a population of resistance vectors, e.g. for a sensitivity sweep or a sampling
+        based global search. the simulations are run in parallel and the losses are reduced together. the losses
+        match the ones minimized by optimize(steady=True), and the optimized resistances are restored afterwards
 
-        blocks_to_optimize = [self.lpa_prox, self.rpa_prox, self.bcs['LPA_BC'], self.bcs['RPA_BC']]
+        :param R_batch: array of shape (N, 4), each row a list of resistances [lpa_prox, rpa_prox, LPA_BC, RPA_BC]
+        :param fun: 'L2' or 'L1', as in compute_steady_loss
+        :param n_procs: number of processes to run the simulations with. None to run serially
 
-        self.lpa_prox.R, self.lpa_prox.C, self.rpa_prox.R, self.rpa_prox.C, self.bcs['LPA_BC'].R, self.bcs['LPA_BC'].C, self.bcs['RPA_BC'].R, self.bcs['RPA_BC'].C = R_guess
-        
-        # run the simulation
-        self.result = self.simulate()
+        :return: array of N losses
+        '''
+        R_batch = np.atleast_2d(np.asarray(R_batch, dtype=np.float64))
+
+        # evaluate under the same conditions as optimize(), and leave the config as it was
+        self._cache_opt_blocks()
+        R_initial = [block.R for block in self._opt_blocks]
+        saved_simparams = self._warm_start_simparams()
+        try:
+            if n_procs is None:
+                residuals = [self.compute_steady_residuals(R_guess) for R_guess in R_batch]
+            else:
+                # the config is sent to each worker once, and the rows are sent in chunks
+                with Pool(n_procs, initializer=_init_pa_worker, initargs=(self,)) as p:
+                    residuals = p.map(_pa_worker_residuals, R_batch, chunksize=max(1, len(R_batch) // (4 * n_procs)))
+        finally:
+            self._restore_simparams(saved_simparams)
+            for block, R in zip(self._opt_blocks, R_initial):
+                block.R = R
 
-        self.result['time'] = np.linspace(min(self.config["boundary_conditions"][0]["bc_values"]["t"]), 
-                                          max(self.config["boundary_conditions"][0]["bc_values"]["t"]), 
-                                          self.config["simulation_parameters"]["number_of_time_pts_per_cardiac_cycle"])
+        # (N, n_residuals), the last four columns are the resistance penalty
+        residuals = np.array(residuals)
 
-        # get the pressures
-        # rpa flow, for flow split optimization
-        self.Q_rpa = get_branch_result(self.result, 'flow_in', 3, steady=True)
+        if fun == 'L2':
+            return np.einsum('ij,ij->i', residuals, residuals)
 
-        self.Q_rpa = trapz(get_branch_result(self.result, 'flow_in', 3, steady=False), self.result['time'])
+        if fun == 'L1':
+            # the resistance penalty is not included in the L1 loss
+            return np.abs(residuals[:, :-4]).sum(axis=1)
 
-        # mpa pressure
-        P_mpa = [p / 1333.2 for p in get_branch_result(self.result, 'pressure_in', 0, steady=False)]
-        self.P_mpa = [np.max(P_mpa), np.min(P_mpa), np.mean(P_mpa)] # just systolic and mean pressures
 
-        # rpa pressure
-        P_rpa = [p / 1333.2 for p in get_branch_result(self.result, 'pressure_out', 1, steady=False)]
-        self.P_rpa = [np.max(P_rpa), np.min(P_rpa), np.mean(P_rpa)]
+    def _report_progress(self, R_guess, loss):
+        '''
+        count a loss evaluation and print the guess and loss every _PRINT_EVERY evaluations if verbose
 
-        # lpa pressure
-        P_lpa = [p / 1333.2 for p in get_branch_result(self.result, 'pressure_out', 3, steady=False)]
-        self.P_lpa = [np.max(P_lpa), np.min(P_lpa), np.mean(P_lpa)]
+        :param R_guess: current optimization parameters
+        :param loss: loss at R_guess
+        '''
+        self._n_evals += 1
+        if self.verbose and self._n_evals % _PRINT_EVERY == 0:
+            print('evaluation ' + str(self._n_evals) + ', R_guess: ' + str(R_guess) + ', loss: ' + str(loss))
 
-        p_neg_loss = 0
 
-        for p in self.P_mpa + self.P_rpa + self.P_lpa:
-            if p < 0:
-                p_neg_loss += 10000
+    def _warm_start_simparams(self):
+        '''
+        start each steady optimization simulation from the steady state solution and only simulate one cardiac cycle.
+        only valid for a constant inflow, otherwise the simulation parameters are left as they are
 
-        if fun == 'L2':
-            loss = np.sum(np.subtract(self.P_mpa, self.clinical_targets.mpa_p) ** 2) + \
-                np.sum(np.subtract(self.P_rpa, self.clinical_targets.rpa_p) ** 2) + \
-                np.sum(np.subtract(self.P_lpa, self.clinical_targets.lpa_p) ** 2) + \
-                100 * np.sum(np.subtract(self.Q_rpa, self.clinical_targets.q_rpa) ** 2) + \
-                np.sum(np.array([1 / block.R for block in [self.lpa_prox, self.rpa_prox]]) ** 2) + p_neg_loss
-        print('R_guess: ' + str(R_guess)) 
-        print('loss: ' + str(loss))
+        :return: the previous simulation parameters, to be passed to _restore_simparams
+        '''
+        if np.ptp(self.bcs['INFLOW'].Q) != 0:
+            # a pulsatile inflow needs the transient cycles to reach a periodic state
+            return {}
 
-        return loss
+        saved = {key: self.simparams.__dict__.get(key) for key in ('steady_initial', 'number_of_cardiac_cycles')}
+
+        self.simparams.steady_initial = True
+        self.simparams.number_of_cardiac_cycles = 1
+
+        return saved
+
+
+    def _restore_simparams(self, saved):
+        '''
+        restore the simulation parameters changed by _warm_start_simparams
+
+        :param saved: dict of the previous simulation parameters, None if they were not set
+        '''
+        for key, value in saved.items():
+            if value is None:
+                self.simparams.__dict__.pop(key, None)
+            else:
+                setattr(self.simparams, key, value)
+
+
+    def _progress_cb(self, xk):
+        '''
+        optimizer callback, called once per iteration with the current best parameters
+        
+        :param xk: current best optimization parameters
+        '''
+        if self.verbose:
+            print('iteration complete after ' + str(self._n_evals) + ' evaluations, current best: ' + str(xk))
+
+
+    def compute_unsteady_loss(self, R_guess, fun='L2'):
+        '''
+        compute unsteady loss by adjusting the resistances in the proximal lpa and rpa'''
+
+        self.lpa_prox.R, self.lpa_prox.C, self.rpa_prox.R, self.rpa_prox.C, self.bcs['LPA_BC'].R, self.bcs['LPA_BC'].C, self.bcs['RPA_BC'].R, self.bcs['RPA_BC'].C = R_guess
+
+        return self._unsteady_loss(R_guess, fun)
 
 
     def compute_unsteady_loss_nonlin(self, R_guess, fun='L2'):
@@ -1306,31 +1946,22 @@ class PAConfig():
         compute unsteady loss by adjusting the stenosis coefficient of the proximal lpa and rpa'''
 
         self.lpa_prox.stenosis_coefficient, self.lpa_prox.C, self.rpa_prox.stenosis_coefficient, self.rpa_prox.C, self.bcs['LPA_BC'].R, self.bcs['LPA_BC'].C, self.bcs['RPA_BC'].R, self.bcs['RPA_BC'].C = R_guess
-        
-        # run the simulation
-        self.result = self.simulate()
 
-        self.result['time'] = np.linspace(min(self.config["boundary_conditions"][0]["bc_values"]["t"]), 
-                                          max(self.config["boundary_conditions"][0]["bc_values"]["t"]), 
-                                          self.config["simulation_parameters"]["number_of_time_pts_per_cardiac_cycle"])
+        return self._unsteady_loss(R_guess, fun)
 
-        # get the pressures
-        # rpa flow, for flow split optimization
-        self.Q_rpa = get_branch_result(self.result, 'flow_in', 3, steady=True)
 
-        self.Q_rpa = trapz(get_branch_result(self.result, 'flow_in', 3, steady=False), self.result['time'])
+    def _unsteady_loss(self, R_guess, fun='L2'):
+        '''
+        simulate the config with the parameters already set and compute the loss compared to the unsteady targets
 
-        # mpa pressure
-        P_mpa = [p / 1333.2 for p in get_branch_result(self.result, 'pressure_in', 0, steady=False)]
-        self.P_mpa = [np.max(P_mpa), np.min(P_mpa), np.mean(P_mpa)] # just systolic and mean pressures
+        :param R_guess: current optimization parameters, for progress reporting
+        :param fun: loss function, only 'L2' is implemented
+        '''
 
-        # rpa pressure
-        P_rpa = [p / 1333.2 for p in get_branch_result(self.result, 'pressure_out', 1, steady=False)]
-        self.P_rpa = [np.max(P_rpa), np.min(P_rpa), np.mean(P_rpa)]
+        # run the simulation
+        self.simulate()
 
-        # lpa pressure
-        P_lpa = [p / 1333.2 for p in get_branch_result(self.result, 'pressure_out', 3, steady=False)]
-        self.P_lpa = [np.max(P_lpa), np.min(P_lpa), np.mean(P_lpa)]
+        self.P_mpa, self.P_rpa, self.P_lpa, self.Q_rpa = _extract_unsteady(self.result)
 
         p_neg_loss = 0
 
@@ -1344,40 +1975,119 @@ class PAConfig():
                 np.sum(np.subtract(self.P_lpa, self.clinical_targets.lpa_p) ** 2) + \
                 100 * np.sum(np.subtract(self.Q_rpa, self.clinical_targets.q_rpa) ** 2) + \
                 np.sum(np.array([1 / block.R for block in [self.lpa_prox, self.rpa_prox]]) ** 2) + p_neg_loss
-        print('R_guess: ' + str(R_guess)) 
-        print('loss: ' + str(loss))
+        self._report_progress(R_guess, loss)
 
         return loss
 
 
-    def optimize(self, steady=True, nonlin=False):
+    def optimize(self, steady=True, nonlin=False, n_procs=None, use_nlopt=False, verbose=False, early_stop_patience=None, early_stop_tol=1e-6):
         '''
         optimize the resistances in the pa config
+
+        :param steady: True to optimize against the steady targets
+        :param nonlin: True to optimize the stenosis coefficients of the proximal vessels in the unsteady case
+        :param n_procs: number of processes used to evaluate the steady finite difference jacobian. None (default) to
+            run serially, which is faster for the small pa model unless each simulation is long
+        :param use_nlopt: True to use NLopt's subplex method instead of scipy's Nelder-Mead in the unsteady case
+        :param verbose: True to print the optimization progress
+        :param early_stop_patience: stop the unsteady Nelder-Mead optimization once the loss has not improved by more than
+            early_stop_tol for this many iterations. None to run until convergence
+        :param early_stop_tol: minimum decrease in the loss which counts as an improvement for early stopping
         '''
 
+        self.verbose = verbose
+        self._n_evals = 0
+
         # self.to_json('pa_config_pre_opt.json')
+        # the boundary conditions may have been replaced since they were created
+        self._cache_opt_blocks()
+
         # define optimization bounds [0, inf)
         bounds = Bounds(lb=0, ub=math.inf)
 
         if steady:
-            result = minimize(self.compute_steady_loss, 
-                                [obj.R for obj in [self.lpa_prox, self.rpa_prox, self.bcs['LPA_BC'], self.bcs['RPA_BC']]], 
-                                method="Nelder-Mead", bounds=bounds)
+            # with constant inflow and resistance bcs the steady initial condition is already the solution, so a single
+            # cardiac cycle from it is enough and the transient cycles are skipped
+            saved_simparams = self._warm_start_simparams()
+            try:
+                # the steady loss is a sum of squares, so solve it as a bounded nonlinear least squares problem
+                initial_guess = [block.R for block in self._opt_blocks]
+                if n_procs is None:
+                    result = least_squares(self.compute_steady_residuals, 
+                                           initial_guess, 
+                                           bounds=(0, np.inf), method='trf', x_scale='jac')
+                else:
+                    # the config is sent to each worker once, with the warm start simulation parameters applied
+                    with Pool(n_procs, initializer=_init_pa_worker, initargs=(self,)) as p:
+                        def parallel_jac(R_guess):
+                            '''
+                            forward difference jacobian of the steady residuals, with the perturbed simulations
+                            run in parallel
+                            '''
+                            x = np.asarray(R_guess, dtype=float)
+                            # the base point has just been evaluated by least_squares, so this is a cache hit
+                            r0 = self.compute_steady_residuals(x)
+                            # same relative step size as the scipy default for finite difference jacobians
+                            h = np.sqrt(np.finfo(float).eps) * np.maximum(1.0, np.abs(x))
+                            perturbed = [x + h[i] * np.eye(len(x))[i] for i in range(len(x))]
+
+                            r = p.map(_pa_worker_residuals, perturbed)
+
+                            return (np.array(r) - r0).T / h
+
+                        result = least_squares(self.compute_steady_residuals, 
+                                               initial_guess, 
+                                               jac=parallel_jac,
+                                               bounds=(0, np.inf), method='trf', x_scale='jac')
+
+                # the blocks hold the last evaluated point, which may be a finite difference step or a rejected trust
+                # region step, so set them and the simulated quantities to the solution
+                self.compute_steady_residuals(result.x)
+            finally:
+                self._restore_simparams(saved_simparams)
         else:
             if nonlin:
+                loss = self.compute_unsteady_loss_nonlin
                 initial_guess = [self.lpa_prox.stenosis_coefficient, self.lpa_prox.C, self.rpa_prox.stenosis_coefficient, self.rpa_prox.C, 
                                  self.bcs['LPA_BC'].R, self.bcs['LPA_BC'].C, 
                                  self.bcs['RPA_BC'].R, self.bcs['RPA_BC'].C]
-                result = minimize(self.compute_unsteady_loss_nonlin, 
-                                initial_guess, 
-                                method="Nelder-Mead", bounds=bounds)
             else:
+                loss = self.compute_unsteady_loss
                 initial_guess = [self.lpa_prox.R, self.lpa_prox.C, self.rpa_prox.R, self.rpa_prox.C, 
                                 self.bcs['LPA_BC'].R, self.bcs['LPA_BC'].C, 
                                 self.bcs['RPA_BC'].R, self.bcs['RPA_BC'].C]
-                result = minimize(self.compute_unsteady_loss, 
-                                    initial_guess, 
-                                    method="Nelder-Mead", bounds=bounds)
+
+            if use_nlopt:
+                result = nlopt_sbplx(loss, 
+                                     initial_guess, 
+                                     bounds=[(0, None)] * len(initial_guess))
+            else:
+                # the resistances and capacitances differ by orders of magnitude, so optimize each parameter relative
+                # to its initial value. xatol is then a relative tolerance on every parameter
+                scale = np.abs(np.asarray(initial_guess, dtype=np.float64))
+                scale[scale == 0.0] = 1.0
+
+                def scaled_loss(x_scaled):
+                    return loss(x_scaled * scale)
+
+                def progress(x_scaled):
+                    self._progress_cb(x_scaled * scale)
+
+                if early_stop_patience is None:
+                    callback = progress
+                else:
+                    callback = _EarlyStopAtMinLoss(tol=early_stop_tol, patience=early_stop_patience, progress=progress)
+
+                x0_scaled = np.asarray(initial_guess, dtype=np.float64) / scale
+                result = minimize(scaled_loss, 
+                                  x0_scaled, 
+                                  method="Nelder-Mead", bounds=bounds,
+                                  callback=callback,
+                                  options={'initial_simplex': _scaled_simplex(x0_scaled),
+                                           'xatol': 1e-3,
+                                           'fatol': 1e-2,
+                                           'adaptive': True})
+                result.x = result.x * scale
 
         print([self.Q_rpa / self.clinical_targets.q, self.P_mpa, self.P_lpa, self.P_rpa])
 
@@ -1480,6 +2190,8 @@ class PAConfig():
             }
         })
 
+        self._cache_opt_blocks()
+
         self.simulate()
 
         print('pa config with RCRs simulated')
@@ -1491,9 +2203,52 @@ class PAConfig():
 
         
 
+    def _blocks(self):
+        '''
+        get the boundary conditions, junctions and vessels of the config. boundary conditions which have been
+        replaced since the config was built are switched to their versioned class here, so their changes are tracked
+
+        :return: list of blocks
+        '''
+
+        return [versioned(bc) for bc in self.bcs.values()] + self._junctions_list + self._vessels_list
+
+
+    def _config_signature(self):
+        '''
+        get the token and version of every block in the config, which changes whenever a block is replaced
+        or one of its parameters is set
+        '''
+
+        return tuple((block.token, block.version) for block in self._blocks())
+
+
+    def _memo_signature(self):
+        '''
+        get the state of the config apart from the optimized resistances, for the steady simulation memo. the
+        optimized blocks are described by their other parameters, since their versions change with every evaluation
+        '''
+        blocks = self._blocks()
+        opt_tokens = {versioned(block).token for block in self._opt_blocks}
+        others = tuple((block.token, block.version) for block in blocks if block.token not in opt_tokens)
+
+        opt_params = []
+        for block in self._opt_blocks:
+            if isinstance(block, Vessel):
+                opt_params.append((block.length, block.C, block.L, block.stenosis_coefficient))
+            else:
+                opt_params.append(tuple((k, v) for k, v in block.values.items() if k not in ('R', 'Rp', 'Rd')))
+
+        return others, tuple(opt_params), tuple(self.simparams.__dict__.items())
+
+
     @property
     def config(self):
-        self.assemble_config()
+        # only reassemble the config if a block has changed since it was last assembled
+        signature = self._config_signature()
+        if signature != getattr(self, '_assembled_signature', None):
+            self.assemble_config()
+            self._assembled_signature = signature
         return self._config
 
         
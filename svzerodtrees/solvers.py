@@ -0,0 +1,232 @@
+import numpy as np
+from numba import njit
+from scipy.optimize import OptimizeResult
+
+# lightweight optimizers for the boundary condition optimization, with the vector arithmetic compiled by numba
+
+@njit(cache=True)
+def _dot(a, b):
+    '''
+    dot product of two vectors
+    '''
+    s = 0.0
+    for i in range(a.size):
+        s += a[i] * b[i]
+    return s
+
+
+@njit(cache=True)
+def _inf_norm(a):
+    '''
+    infinity norm of a vector
+    '''
+    m = 0.0
+    for i in range(a.size):
+        if abs(a[i]) > m:
+            m = abs(a[i])
+    return m
+
+
+@njit(cache=True)
+def _step(x, alpha, d):
+    '''
+    take a step of length alpha along direction d
+    '''
+    out = np.empty_like(x)
+    for i in range(x.size):
+        out[i] = x[i] + alpha * d[i]
+    return out
+
+
+@njit(cache=True)
+def _polak_ribiere_direction(g_new, g_old, d_old):
+    '''
+    compute the next conjugate direction with the Polak-Ribiere+ update, which restarts along the steepest
+    descent direction when beta becomes negative
+    '''
+    num = 0.0
+    den = 0.0
+    for i in range(g_new.size):
+        num += g_new[i] * (g_new[i] - g_old[i])
+        den += g_old[i] * g_old[i]
+
+    beta = num / den if den > 0.0 else 0.0
+    if beta < 0.0:
+        beta = 0.0
+
+    d = np.empty_like(g_new)
+    for i in range(g_new.size):
+        d[i] = -g_new[i] + beta * d_old[i]
+    return d
+
+
+@njit(cache=True)
+def _forward_difference(f_perturbed, f0, h):
+    '''
+    forward difference gradient from the objective values at the perturbed points
+    '''
+    g = np.empty_like(h)
+    for i in range(h.size):
+        g[i] = (f_perturbed[i] - f0) / h[i]
+    return g
+
+
+def cg_njit(f, x0, args=(), jac=None, eps=None, maxiter=200, gtol=1e-5, c1=1e-4, max_backtracks=30):
+    '''
+    nonlinear conjugate gradient (Polak-Ribiere+) with a backtracking Armijo line search. the objective is
+    called from python, everything else is numba compiled, so this avoids most of the per-iteration overhead
+    of scipy.optimize.minimize when the objective itself is cheap
+
+    :param f: objective function f(x, *args)
+    :param x0: initial guess
+    :param args: extra arguments to f and jac
+    :param jac: optional gradient function jac(x, *args). if None, a forward difference gradient is used
+    :param eps: relative finite difference step size. default is the square root of machine epsilon
+    :param maxiter: maximum number of iterations
+    :param gtol: stop when the infinity norm of the gradient is below gtol
+    :param c1: Armijo sufficient decrease parameter
+    :param max_backtracks: maximum number of step halvings in the line search
+
+    :return: scipy OptimizeResult with x, fun, jac, nit, nfev
+    '''
+
+    if eps is None:
+        eps = np.sqrt(np.finfo(float).eps)
+
+    x = np.asarray(x0, dtype=np.float64).copy()
+    nfev = 0
+
+    def fun(x):
+        nonlocal nfev
+        nfev += 1
+        return float(f(x, *args))
+
+    def grad(x, fx):
+        if jac is not None:
+            return np.asarray(jac(x, *args), dtype=np.float64)
+        h = eps * np.maximum(1.0, np.abs(x))
+        f_perturbed = np.empty_like(x)
+        for i in range(x.size):
+            x_i = x.copy()
+            x_i[i] += h[i]
+            f_perturbed[i] = fun(x_i)
+        return _forward_difference(f_perturbed, fx, h)
+
+    fx = fun(x)
+    g = grad(x, fx)
+    d = -g
+    f_old = None
+    message = 'Maximum number of iterations has been exceeded.'
+    success = False
+
+    nit = 0
+    while nit < maxiter:
+        if _inf_norm(g) < gtol:
+            message = 'Optimization terminated successfully.'
+            success = True
+            break
+
+        slope = _dot(g, d)
+        if slope >= 0.0:
+            # not a descent direction, restart along steepest descent
+            d = -g
+            slope = -_dot(g, g)
+
+        # initial step from the previous decrease in the objective, as in scipy's cg
+        if f_old is None:
+            alpha = 1.0 / max(1.0, _inf_norm(g))
+        else:
+            alpha = min(1.0, 1.01 * 2 * (fx - f_old) / slope)
+            if alpha <= 0.0:
+                alpha = 1.0
+
+        # backtracking line search
+        for _ in range(max_backtracks):
+            x_new = _step(x, alpha, d)
+            f_new = fun(x_new)
+            if f_new <= fx + c1 * alpha * slope:
+                break
+            alpha *= 0.5
+        else:
+            message = 'Desired error not necessarily achieved due to precision loss.'
+            break
+
+        g_new = grad(x_new, f_new)
+        d = _polak_ribiere_direction(g_new, g, d)
+
+        f_old = fx
+        x, fx, g = x_new, f_new, g_new
+        nit += 1
+
+    return OptimizeResult(x=x, fun=fx, jac=g, nit=nit, nfev=nfev, success=success, message=message)
+
+
+def bobyqa(f, x0, args=(), bounds=None, maxfun=None):
+    '''
+    derivative free, bound constrained optimization with Py-BOBYQA, which builds a quadratic model of the
+    objective and usually needs far fewer function evaluations than finite difference gradient methods
+
+    :param f: objective function f(x, *args)
+    :param x0: initial guess
+    :param args: extra arguments to f
+    :param bounds: list of (lower, upper) bounds for each variable, with None for no bound
+    :param maxfun: maximum number of function evaluations. default is the Py-BOBYQA default
+
+    :return: scipy OptimizeResult with x, fun, nit, nfev
+    '''
+
+    try:
+        import pybobyqa
+    except ImportError:
+        raise ImportError('Py-BOBYQA is required for the BOBYQA method, install it with pip install Py-BOBYQA')
+
+    x0 = np.asarray(x0, dtype=np.float64)
+
+    if bounds is not None:
+        lower = np.array([-np.inf if lb is None else lb for lb, ub in bounds], dtype=np.float64)
+        upper = np.array([np.inf if ub is None else ub for lb, ub in bounds], dtype=np.float64)
+        bounds = (lower, upper)
+
+    soln = pybobyqa.solve(f, x0, args=args, bounds=bounds, maxfun=maxfun)
+
+    return OptimizeResult(x=soln.x, fun=soln.f, nit=soln.nf, nfev=soln.nf,
+                          success=soln.flag == soln.EXIT_SUCCESS, message=soln.msg)
+
+
+def nlopt_sbplx(f, x0, args=(), bounds=None, xtol_rel=1e-6, maxeval=None):
+    '''
+    derivative free, bound constrained optimization with NLopt's subplex algorithm, a Nelder-Mead variant with the
+    simplex iterations run in C rather than python
+
+    :param f: objective function f(x, *args)
+    :param x0: initial guess
+    :param args: extra arguments to f
+    :param bounds: list of (lower, upper) bounds for each variable, with None for no bound
+    :param xtol_rel: relative tolerance on the optimization parameters
+    :param maxeval: maximum number of function evaluations. default is no limit
+
+    :return: scipy OptimizeResult with x, fun, nit, nfev
+    '''
+
+    try:
+        import nlopt
+    except ImportError:
+        raise ImportError('NLopt is required for the subplex method, install it with pip install nlopt')
+
+    x0 = np.asarray(x0, dtype=np.float64)
+
+    opt = nlopt.opt(nlopt.LN_SBPLX, x0.size)
+    # nlopt passes a gradient array, which is empty for derivative free algorithms
+    opt.set_min_objective(lambda x, grad: float(f(x, *args)))
+    if bounds is not None:
+        opt.set_lower_bounds([-np.inf if lb is None else lb for lb, ub in bounds])
+        opt.set_upper_bounds([np.inf if ub is None else ub for lb, ub in bounds])
+    opt.set_xtol_rel(xtol_rel)
+    if maxeval is not None:
+        opt.set_maxeval(maxeval)
+
+    x = opt.optimize(x0)
+    status = opt.last_optimize_result()
+
+    return OptimizeResult(x=x, fun=opt.last_optimum_value(), nit=opt.get_numevals(), nfev=opt.get_numevals(),
+                          success=status > 0, status=status)
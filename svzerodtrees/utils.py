@@ -4,7 +4,13 @@ import matplotlib.pyplot as plt
 from io import StringIO
 import pandas as pd
 import copy
+import json
+import math
 import pysvzerod
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # utilities for working with zero D trees
 
@@ -388,12 +394,20 @@ def plot_optimization_progress(fun, save=False, path=None):
     :param save: save the plot after optimization is complete
     :param path: path to figures directory to save the optimization plot
     '''
-    plt.clf()
-    plt.plot(range(len(fun)), fun, marker='o')
-    plt.xlabel('Iterations')
-    plt.ylabel('Objective Function Value')
-    plt.title('Optimization Progress')
-    plt.yscale('log')
+    # update the existing progress line rather than redrawing the whole figure
+    ax = plt.gca()
+    lines = [line for line in ax.get_lines() if line.get_label() == 'optimization progress']
+    if lines:
+        lines[0].set_data(range(len(fun)), fun)
+        ax.relim()
+        ax.autoscale_view()
+    else:
+        plt.clf()
+        plt.plot(range(len(fun)), fun, marker='o', label='optimization progress')
+        plt.xlabel('Iterations')
+        plt.ylabel('Objective Function Value')
+        plt.title('Optimization Progress')
+        plt.yscale('log')
     plt.pause(0.001)
     if save:
         plt.savefig(str(path) + '/optimization_result.png')
@@ -431,6 +445,68 @@ def run_svzerodplus(config: dict, dtype='ndarray'):
 
     result = pysvzerod.simulate(config)
 
+    return _format_result(result, config, dtype)
+
+
+def run_svzerodplus_batch(config: dict, bc_values: list, dtype='ndarray'):
+    """Run the svzerodplus solver for a batch of boundary condition values on the same model.
+
+    the model is compiled once from config, and only the boundary condition parameters are swapped between
+    solves, so the json parsing and model setup cost is paid once for the whole batch
+
+    :param config: svzerodplus config dict
+    :param bc_values: list of dicts, each mapping bc names to a bc_values dict to solve with. bcs not in the
+        dict keep their value from config
+    :param dtype: data type of the result arrays, either dict or ndarray. default is ndarray.
+
+    :return outputs: list of results, one per entry of bc_values, in the same format as run_svzerodplus
+    """
+
+    bc_configs = {bc["bc_name"]: bc for bc in config["boundary_conditions"]}
+    current = {name: dict(bc["bc_values"]) for name, bc in bc_configs.items()}
+
+    solver = pysvzerod.Solver(config)
+
+    outputs = []
+    for values in bc_values:
+        for name, vals in values.items():
+            if vals != current[name]:
+                solver.update_block_params(name, bc_block_params(bc_configs[name]["bc_type"], vals))
+                current[name] = dict(vals)
+
+        solver.run()
+        outputs.append(_format_result(solver.get_full_result(), config, dtype))
+
+    return outputs
+
+
+def bc_block_params(bc_type: str, values: dict):
+    """get the parameter list of a boundary condition block in the order used by the svzerodplus solver
+
+    :param bc_type: boundary condition type
+    :param values: bc_values dict
+
+    :return params: list of block parameters
+    """
+
+    if bc_type == "RESISTANCE":
+        return [values["R"], values.get("Pd", 0.0)]
+    elif bc_type == "RCR":
+        return [values["Rp"], values["C"], values["Rd"], values.get("Pd", 0.0)]
+    else:
+        raise ValueError("cannot update parameters of a " + bc_type + " boundary condition in an existing solver")
+
+
+def _format_result(result, config: dict, dtype='ndarray'):
+    """format a svzerodplus result dataframe into a dict of results by branch
+
+    :param result: svzerodplus result dataframe
+    :param config: svzerodplus config dict the result was computed with
+    :param dtype: data type of the result arrays, either dict or ndarray. default is ndarray.
+
+    :return output: the result of the simulation as a dict of dicts with each array denoted by its branch id
+    """
+
     output = {
         "time": result["time"],
         "pressure_in": {},
@@ -493,6 +569,76 @@ def write_to_log(log_file, message: str, write=False):
                 log.write(message +  "\n")
 
 
+def read_json(file_name):
+    '''
+    read a json file, with orjson if it is installed since it is much faster for large configs. files with NaN or
+    Infinity values, which orjson does not accept, are read with the standard json module
+
+    :param file_name: path to the json file
+
+    :return: the loaded json object
+    '''
+    with open(file_name, 'rb') as ff:
+        data = ff.read()
+
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+
+    return json.loads(data)
+
+
+def write_json(obj, file_name):
+    '''
+    write an object to a json file, with orjson if it is installed since it is much faster for large configs. orjson
+    writes NaN and Infinity as null, so if its output has a null which is not a None in the object (e.g. a diverged
+    impedance), the object is written with the standard json module instead, with an indent of 4
+
+    :param obj: object to write, e.g. a config dict
+    :param file_name: path to the json file
+    '''
+    if orjson is not None:
+        data = orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_INDENT_2)
+        # without a null nothing can have been dropped, so the object is only checked when there is one
+        if b'null' not in data or _all_finite(obj):
+            with open(file_name, 'wb') as ff:
+                ff.write(data)
+            return
+
+    with open(file_name, 'w') as ff:
+        json.dump(obj, ff, indent=4, default=_json_default)
+
+
+def _all_finite(obj):
+    '''
+    check that a json-like object has no NaN or infinite float values
+
+    :param obj: dict, list, array or scalar
+
+    :return: True if every float in obj is finite
+    '''
+    if isinstance(obj, dict):
+        return all(_all_finite(value) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return all(_all_finite(value) for value in obj)
+    if isinstance(obj, np.ndarray):
+        return obj.dtype.kind not in 'fc' or bool(np.isfinite(obj).all())
+    if isinstance(obj, (float, np.floating)):
+        return math.isfinite(obj)
+    return True
+
+
+def _json_default(obj):
+    '''
+    convert numpy arrays and scalars for the standard json module
+    '''
+    if isinstance(obj, (np.ndarray, np.generic)):
+        return obj.tolist()
+    raise TypeError('Object of type ' + type(obj).__name__ + ' is not JSON serializable')
+
+
 def get_branch_id(vessel_config):
     '''
     get the integer id of a branch for a given vessel